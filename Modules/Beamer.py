@@ -1,5 +1,7 @@
+import hashlib
 import numpy as np
 from matplotlib.axes import Axes
+from matplotlib.collections import EllipseCollection
 
 import os
 import sys
@@ -10,8 +12,11 @@ parent_dir = os.path.dirname(current_dir)
 # Add the parent directory to sys.path
 sys.path.append(parent_dir)
 
-from Utilities.Transform import rotate, translate
-from Modules.ShapeShadow import Ellipse
+from Utilities.Transform import Affine
+from Utilities.Spatial import GridIndex
+from Utilities import Path
+from Modules.Templates import collection_style
+from Modules.ShapeShadow import Ellipse, EllipseArray, Shape
 
 
 
@@ -94,20 +99,456 @@ class MapPattern:
         return self.xy.shape[1]
     
 
-    def xy_instrument(self) -> np.ndarray:
+    def transform(self) -> Affine:
+        """
+        Returns the transformation from pattern to instrument coordinates,
+        i.e. rotation by 'theta_offset' followed by translation by 'xy_offset'
+
+        - returns: Affine
+        """
+
+        return Affine.rotation(self.t_offset).translate(*self.xy_offset)
+
+
+    def xy_instrument(self, dtype=None) -> np.ndarray:
         """
         Returns the x- and y-coordinates of the instrument.
         Dimensions [2, N]
 
+        - dtype: optional floating point type of the result, e.g. np.float32
         - returns: np.ndarray
         """
-        
-        xy_inst = self.xy.copy()
 
-        xy_inst = rotate(xy_inst, self.t_offset)
-        xy_inst = translate(xy_inst, self.xy_offset)
+        return self.transform().apply(self.xy, dtype=dtype)
+
+
+    def xy_pattern(self, xy_instrument:np.ndarray, dtype=None) -> np.ndarray:
+        """
+        Maps instrument coordinates back to pattern coordinates,
+        i.e. the inverse of 'xy_instrument'.
+        Dimensions [2, N]
+
+        - xy_instrument: np.ndarray dimension [2, N]
+        - dtype: optional floating point type of the result, e.g. np.float32
+        - returns: np.ndarray
+        """
+
+        return self.transform().inverse().apply(xy_instrument, dtype=dtype)
+
+
+
+    def reorder(self, order:np.ndarray):
+        """
+        Returns a new MapPattern with the points in 'order'
+
+        - order: np.ndarray of indices, dimension [N]
+        - returns: MapPattern
+        """
+
+        return MapPattern(*self.xy[:, order], *self.xy_offset, self.t_offset)
+
+
+    def order_path(self, method:str='auto', stage:Path.StageModel=None, max_two_opt:int=2000) -> tuple:
+        """
+        Orders the points to shorten the stage travel time of the map.
+        Moves are evaluated in instrument coordinates, starting at the
+        first point of the pattern.
+
+        - method:
+            'serpentine': row by row along the pattern x-axis, alternating
+                direction (grid patterns, rows are found before the theta offset)
+            'nearest': nearest neighbour followed by 2-opt improvement
+            'auto': the faster of the two
+        - stage: travel time model, e.g. with a rotation speed for theta
+            stages (default: x/y stage at 1 unit per second)
+        - max_two_opt: patterns with more points skip the 2-opt improvement
+        - returns: (MapPattern, report)
+            report: travel distance and time before and after
+        """
+
+        if stage is None:
+            stage = Path.StageModel()
+
+        if method not in ('auto', 'serpentine', 'nearest'):
+            raise ValueError(f"Unsupported method, supported are; 'auto', 'serpentine', 'nearest', were given; {method}.")
+
+        xy = self.xy_instrument()
+        candidates = []
 
-        return xy_inst
+        if method in ('auto', 'serpentine'):
+            # Rows of the pattern, which are not along x once rotated by the theta offset
+            candidates.append(Path.serpentine_order(self.xy))
+
+        if method in ('auto', 'nearest') and xy.shape[1] > 0:
+            order = Path.nearest_neighbour_order(xy, stage)
+            if xy.shape[1] <= max_two_opt:
+                order = Path.two_opt(xy, order, stage)
+            candidates.append(order)
+
+        if len(candidates) == 0:
+            candidates.append(np.arange(xy.shape[1]))
+
+        order = min(candidates, key=lambda order: stage.path_time(xy[:, order]))
+
+        report = {
+            'distance_before': Path.path_length(xy),
+            'distance_after': Path.path_length(xy[:, order]),
+            'time_before': stage.path_time(xy),
+            'time_after': stage.path_time(xy[:, order]),
+        }
+
+        return self.reorder(order), report
+
+
+    def calibrate(self, xy_measured:np.ndarray, index:np.ndarray=None, robust:bool=False, threshold:float=3.0) -> tuple:
+        """
+        Returns a new MapPattern with the offsets fitted to reference points
+        measured on the tool, see 'fit_offsets'
+
+        - xy_measured: measured instrument coordinates, dimension [2, M]
+        - index: points of the pattern that were measured, dimension [M]
+            (default: the first M points)
+        - robust, threshold: outlier rejection, see 'fit_offsets'
+        - returns: (MapPattern, report)
+        """
+
+        xy_measured = np.asarray(xy_measured, dtype=float)
+        if index is None:
+            index = np.arange(xy_measured.shape[1])
+
+        report = fit_offsets(self.xy[:, index], xy_measured, robust=robust, threshold=threshold)
+        pattern = MapPattern(*self.xy, report['x_offset'], report['y_offset'], report['theta_offset'])
+
+        return pattern, report
+
+
+    def clip(self, sample:Shape, edge_exclusion:float=0.0):
+        """
+        Returns a new MapPattern with only the points whose instrument
+        coordinates lie inside 'sample' and at least 'edge_exclusion' from its
+        edge. Only the spot centers are tested, see SpotCollection.inside for
+        the full footprint.
+
+        - sample: outline of the sample in instrument coordinates
+        - edge_exclusion: minimum distance of the points from the sample edge
+        - returns: MapPattern
+        """
+
+        keep = sample.signed_distance(self.xy_instrument()) <= -edge_exclusion
+
+        return MapPattern(*self.xy[:, keep], *self.xy_offset, self.t_offset)
+
+
+    @classmethod
+    def _from_points_(
+            cls,
+            xy:np.ndarray,
+            x_offset:float,
+            y_offset:float,
+            theta_offset:float,
+            sample:Shape,
+            edge_exclusion:float,
+        ):
+        """
+        Creates the MapPattern of the generated points 'xy', clipped to 'sample' if given
+        """
+        pattern = cls(xy[0], xy[1], x_offset, y_offset, theta_offset)
+
+        if sample is not None:
+            pattern = pattern.clip(sample, edge_exclusion)
+
+        return pattern
+
+
+    @staticmethod
+    def _axis_(length:float, pitch:float) -> np.ndarray:
+        """
+        Returns the coordinates with spacing 'pitch' spanning at most
+        'length', centered on 0
+        """
+        n = int(np.floor(length / pitch + 1e-9)) + 1
+
+        return (np.arange(n) - 0.5 * (n - 1)) * pitch
+
+
+    @classmethod
+    def polar(
+            cls,
+            radius:float,
+            n_rings:int,
+            points_per_ring:int=None,
+            center:bool=True,
+            angle:float=0.0,
+            x_offset:float=0.0,
+            y_offset:float=0.0,
+            theta_offset:float=0.0,
+            sample:Shape=None,
+            edge_exclusion:float=0.0,
+        ):
+        """
+        Creates a polar pattern of 'n_rings' equally spaced rings, the outer
+        ring at 'radius'.
+
+        - points_per_ring: points on every ring, default: proportional to the
+            ring radius, spaced about the ring spacing along each ring
+        - center: include a point at the center
+        - angle: angle of the first point of every ring, in degrees
+        - x_offset, y_offset, theta_offset: offsets, see MapPattern
+        - sample, edge_exclusion: clip the pattern, see 'clip'
+        """
+
+        radii = radius * np.arange(1, n_rings + 1) / n_rings
+
+        if points_per_ring is None:
+            counts = np.maximum(np.rint(2 * np.pi * np.arange(1, n_rings + 1)).astype(int), 1)
+        else:
+            counts = np.full(n_rings, points_per_ring)
+
+        # Index of every point within its ring
+        ring = np.repeat(np.arange(n_rings), counts)
+        position = np.arange(ring.size) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        phi = np.deg2rad(angle) + 2 * np.pi * position / counts[ring]
+        xy = radii[ring] * np.array([np.cos(phi), np.sin(phi)])
+
+        if center:
+            xy = np.concatenate([np.zeros((2, 1)), xy], axis=1)
+
+        return cls._from_points_(xy, x_offset, y_offset, theta_offset, sample, edge_exclusion)
+
+
+    @classmethod
+    def grid(
+            cls,
+            width:float,
+            height:float=None,
+            pitch:float=1.0,
+            pitch_y:float=None,
+            x_offset:float=0.0,
+            y_offset:float=0.0,
+            theta_offset:float=0.0,
+            sample:Shape=None,
+            edge_exclusion:float=0.0,
+        ):
+        """
+        Creates a rectilinear grid centered on (0, 0), row by row
+
+        - width, height: extent of the grid, height defaults to width
+        - pitch, pitch_y: spacing in x and y, pitch_y defaults to pitch
+        - x_offset, y_offset, theta_offset: offsets, see MapPattern
+        - sample, edge_exclusion: clip the pattern, see 'clip'
+        """
+
+        if height is None:
+            height = width
+        if pitch_y is None:
+            pitch_y = pitch
+
+        x, y = np.meshgrid(cls._axis_(width, pitch), cls._axis_(height, pitch_y))
+        xy = np.array([x.ravel(), y.ravel()])
+
+        return cls._from_points_(xy, x_offset, y_offset, theta_offset, sample, edge_exclusion)
+
+
+    @classmethod
+    def hex(
+            cls,
+            width:float,
+            height:float=None,
+            pitch:float=1.0,
+            x_offset:float=0.0,
+            y_offset:float=0.0,
+            theta_offset:float=0.0,
+            sample:Shape=None,
+            edge_exclusion:float=0.0,
+        ):
+        """
+        Creates a hexagonal grid centered on (0, 0), row by row. Every point
+        is 'pitch' from its six neighbours, rows are pitch*sqrt(3)/2 apart
+        and every other row is shifted by half a pitch.
+
+        - width, height: extent of the grid, height defaults to width
+        - pitch: distance between neighbouring points
+        - x_offset, y_offset, theta_offset: offsets, see MapPattern
+        - sample, edge_exclusion: clip the pattern, see 'clip'
+        """
+
+        if height is None:
+            height = width
+
+        x = cls._axis_(width, pitch)
+        y = cls._axis_(height, pitch * np.sqrt(3) / 2)
+
+        shift = 0.5 * pitch * (np.arange(len(y)) % 2)
+
+        xx = x[np.newaxis, :] + shift[:, np.newaxis]
+        yy = np.broadcast_to(y[:, np.newaxis], xx.shape)
+        xy = np.array([xx.ravel(), yy.ravel()])
+
+        return cls._from_points_(xy, x_offset, y_offset, theta_offset, sample, edge_exclusion)
+
+
+    @classmethod
+    def line(
+            cls,
+            length:float,
+            n_points:int,
+            angle:float=0.0,
+            x_offset:float=0.0,
+            y_offset:float=0.0,
+            theta_offset:float=0.0,
+            sample:Shape=None,
+            edge_exclusion:float=0.0,
+        ):
+        """
+        Creates a line scan of 'n_points' equally spaced points, centered on (0, 0)
+
+        - length: distance between the first and the last point
+        - angle: direction of the line, in degrees from the x-axis
+        - x_offset, y_offset, theta_offset: offsets, see MapPattern
+        - sample, edge_exclusion: clip the pattern, see 'clip'
+        """
+
+        t = np.linspace(-0.5 * length, 0.5 * length, n_points)
+        direction = np.array([np.cos(np.deg2rad(angle)), np.sin(np.deg2rad(angle))])
+        xy = direction[:, np.newaxis] * t
+
+        return cls._from_points_(xy, x_offset, y_offset, theta_offset, sample, edge_exclusion)
+
+
+
+def fit_offsets(
+        xy_pattern:np.ndarray,
+        xy_measured:np.ndarray,
+        robust:bool=False,
+        threshold:float=3.0,
+        max_iterations:int=20,
+    ) -> dict:
+    """
+    Fits the x, y and theta offsets of a MapPattern to reference points,
+    i.e. the least-squares rotation and translation taking the nominal
+    pattern positions onto the positions measured on the tool.
+
+    - xy_pattern: nominal positions in pattern coordinates, dimension [2, N]
+    - xy_measured: measured instrument coordinates, dimension [2, N]
+    - robust: reject outliers, points whose residual exceeds 'threshold'
+        times the robust spread (1.4826 * median) of the inlier residuals
+        are left out and the fit is repeated until the inliers settle
+    - max_iterations: maximum number of robust refits
+    - returns: dictionary
+        x_offset, y_offset, theta_offset: fitted offsets (degrees for theta)
+        residuals: measured minus fitted positions, dimension [2, N]
+        inliers: np.ndarray of bool [N], points used in the final fit
+        rms: root mean square residual distance of the inliers
+    """
+    xy_pattern = np.asarray(xy_pattern, dtype=float)
+    xy_measured = np.asarray(xy_measured, dtype=float)
+
+    def fit(inliers:np.ndarray) -> tuple[Affine, np.ndarray, np.ndarray]:
+        transform = Affine.fit_rigid(xy_pattern, xy_measured, weights=inliers)
+        residuals = xy_measured - transform.apply(xy_pattern)
+
+        return transform, residuals, np.hypot(residuals[0], residuals[1])
+
+    inliers = np.ones(xy_pattern.shape[1], dtype=bool)
+    transform, residuals, distance = fit(inliers)
+
+    for _ in range(max_iterations if robust else 0):
+        spread = 1.4826 * np.median(distance[inliers])
+        updated = distance <= threshold * max(spread, np.finfo(float).eps)
+
+        # Keeps enough points for a rotation
+        if np.count_nonzero(updated) < 2 or np.array_equal(updated, inliers):
+            break
+
+        inliers = updated
+        transform, residuals, distance = fit(inliers)
+
+    return {
+        'x_offset': float(transform.offset[0]),
+        'y_offset': float(transform.offset[1]),
+        'theta_offset': float(np.rad2deg(np.arctan2(transform.matrix[1, 0], transform.matrix[0, 0]))),
+        'residuals': residuals,
+        'inliers': inliers,
+        'rms': float(np.sqrt(np.mean(distance[inliers]**2))),
+    }
+
+
+
+class CoverageMap:
+    """
+    Spot footprints rasterized onto a regular grid, clipped to the sample.
+    """
+
+    def __init__(self, counts:np.ndarray, sample_mask:np.ndarray, extent:tuple[float, float, float, float], resolution:float) -> None:
+        """
+        - counts: number of footprints covering each cell, dimension [ny, nx]
+        - sample_mask: cells with their center inside the sample, dimension [ny, nx]
+        - extent: (x_min, x_max, y_min, y_max) of the grid
+        - resolution: side length of a grid cell
+        """
+
+        self.counts = counts
+        self.sample_mask = sample_mask
+        self.extent = extent
+        self.resolution = resolution
+
+        return None
+
+
+    def cell_area(self) -> float:
+        """
+        Returns the area of a single grid cell
+        """
+
+        return self.resolution**2
+
+
+    def area(self) -> float:
+        """
+        Returns the union area covered by the spots (overlaps counted once)
+        """
+
+        return np.count_nonzero(self.counts) * self.cell_area()
+
+
+    def overlap_area(self) -> float:
+        """
+        Returns the area covered by two or more spots
+        """
+
+        return np.count_nonzero(self.counts > 1) * self.cell_area()
+
+
+    def sample_area(self) -> float:
+        """
+        Returns the rasterized area of the sample
+        """
+
+        return np.count_nonzero(self.sample_mask) * self.cell_area()
+
+
+    def fraction(self) -> float:
+        """
+        Returns the fraction of the sample covered by the spots
+        """
+
+        sample_area = self.sample_area()
+        if sample_area == 0:
+            return 0.0
+
+        return self.area() / sample_area
+
+
+    def plot(self, axes:Axes, **kwargs) -> None:
+        """
+        Plots the overlap-count map, cells outside the sample are left blank
+        """
+
+        counts = np.ma.masked_where(~self.sample_mask, self.counts)
+        axes.imshow(counts, extent=self.extent, origin='lower', interpolation='nearest', **kwargs)
+
+        return None
 
 
 
@@ -120,36 +561,437 @@ class SpotCollection:
         self.map_pattern = map_pattern
         self.spot = spot
 
+        self._index: GridIndex = None
+        self._index_key: tuple = None
+
         return None
+
+
+    def footprints(self, dtype=np.float64) -> EllipseArray:
+        """
+        Returns the footprints of all spots as one EllipseArray,
+        centered on the instrument coordinates of the map pattern
+        """
+
+        return EllipseArray(
+            centers=self.map_pattern.xy_instrument(dtype=dtype),
+            widths=self.spot.width,
+            heights=self.spot.height,
+            angles=self.spot.angle,
+            dtype=dtype,
+        )
+
+
+    def index(self) -> GridIndex:
+        """
+        Returns a spatial index over the instrument coordinates of the spots,
+        with a cell size of the spot major.
+
+        The index is built lazily and only rebuilt when the map pattern,
+        its points or offsets, or the spot size change. The points are
+        compared by a hash of their content, so in-place changes are seen.
+        """
+        mp = self.map_pattern
+        key = (
+            mp,
+            hashlib.blake2b(np.ascontiguousarray(mp.xy).tobytes(), digest_size=16).digest(),
+            mp.xy.shape, mp.xy.dtype.str,
+            tuple(mp.xy_offset), mp.t_offset,
+            self.spot.width, self.spot.height, self.spot.angle,
+        )
+
+        if key != self._index_key:
+            cell = max(self.spot.width, self.spot.height)
+            self._index = GridIndex(mp.xy_instrument(), cell)
+            self._index_key = key
+
+        return self._index
+
+
+    def invalidate(self) -> None:
+        """
+        Discards the cached spatial index, it is rebuilt on the next use
+        """
+        self._index = None
+        self._index_key = None
+
+        return None
+
+
+    def overlaps(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds all pairs of spots with overlapping footprints.
+
+        Candidate pairs come from the spatial index, the exact test uses that
+        two equal, equally rotated ellipses overlap when the distance between
+        their centers, measured in units of the semi-axes, is below 2.
+
+        - returns: (i, j) with i < j for every overlapping pair
+        """
+        index = self.index()
+        i, j = index.pairs(max(self.spot.width, self.spot.height))
+
+        d = Affine.rotation(-self.spot.angle).apply(index.xy[:, j] - index.xy[:, i])
+        u = d[0] / (0.5 * self.spot.width)
+        v = d[1] / (0.5 * self.spot.height)
+
+        overlap = u**2 + v**2 < 4
+
+        return i[overlap], j[overlap]
+
+
+    def nearest(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the distance to, and index of, the nearest neighbour of every spot
+        """
+
+        return self.index().nearest()
+
+
+    def nearest_statistics(self) -> dict[str, float]:
+        """
+        Returns statistics of the nearest neighbour distances (center to center)
+        """
+
+        distance, _ = self.nearest()
+        distance = distance[np.isfinite(distance)]
+
+        if len(distance) == 0:
+            return {'min': np.nan, 'mean': np.nan, 'median': np.nan, 'max': np.nan, 'std': np.nan}
+
+        return {
+            'min': distance.min(),
+            'mean': distance.mean(),
+            'median': np.median(distance),
+            'max': distance.max(),
+            'std': distance.std(),
+        }
+
+
+    def within(self, xy:np.ndarray, radius:float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds all spots within 'radius' of the points 'xy' (instrument coordinates)
+
+        - xy: np.ndarray dimension [2, M]
+        - returns: (point index, spot index) of all matches
+        """
+
+        return self.index().query(xy, radius)
     
 
-    def coverate(self) -> float:
+    def coverate(self, sample:Shape=None) -> float:
         """
         Returns the area covered by the spots
+
+        DEPRECATED: without 'sample' this is the sum of the footprint areas,
+        overlaps and spots falling off the sample are not accounted for.
+        Use 'coverage(sample).area()', which 'sample' is routed to.
+
+        - sample: outline of the sample, e.g. Sector, Circle or Rectangle
         """
 
+        if sample is not None:
+            return self.coverage(sample).area()
+
         return self.map_pattern.count() * self.spot.area()
-    
 
-    def plot(self, axes:Axes, as_ellipse=False, **kwargs) -> None:
+
+    def inside(self, sample:Shape, margin:float=0.0, n_points:int=64, chunksize:int=4096) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Checks whether the full elliptical footprint of every spot lies inside
+        the sample, including an edge exclusion 'margin'.
+
+        The footprint outline is sampled with 'n_points' and the signed
+        distance to the sample edge is evaluated for all spots at once
+        (in chunks of 'chunksize' spots to bound memory).
+
+        - sample: outline of the sample, e.g. Sector, Circle or Rectangle
+        - margin: edge exclusion, distance the footprint must keep from the sample edge
+        - returns: (mask, overhang)
+            mask: np.ndarray of bool [N], True where the footprint is inside
+            overhang: np.ndarray [N], worst-case distance the footprint extends
+                beyond the edge exclusion (<= 0 when inside)
+        """
+
+        xy = self.map_pattern.xy_instrument()
+
+        # Footprint outline relative to the spot center, dimension [2, 1, K]
+        footprint = self.spot.outline(n=n_points) - self.spot.center[:, np.newaxis]
+        footprint = footprint[:, np.newaxis, :]
+
+        overhang = np.empty(xy.shape[1])
+        for start in range(0, xy.shape[1], chunksize):
+            stop = start + chunksize
+
+            points = xy[:, start:stop, np.newaxis] + footprint
+            distance = sample.signed_distance(points.reshape(2, -1))
+
+            overhang[start:stop] = distance.reshape(points.shape[1:]).max(axis=1)
+
+        overhang += margin
+
+        return overhang <= 0, overhang
+
+
+    def coverage(self, sample:Shape, resolution:float=None, max_cells:int=2**22, max_grid_cells:int=2**26) -> CoverageMap:
+        """
+        Rasterizes all spot footprints onto a grid covering the sample and
+        counts how many footprints cover each cell. Overlaps and spots
+        falling off the sample are accounted for.
+
+        Every spot is only evaluated inside its own bounding box, and the
+        spots are processed in batches of at most 'max_cells' evaluated
+        cells to bound memory. The sample is clipped in blocks of rows of
+        at most 'max_cells' cells as well.
+
+        - sample: outline of the sample, e.g. Sector, Circle or Rectangle
+        - resolution: side length of a grid cell (default: 1/20 of the spot minor)
+        - max_grid_cells: largest grid allowed, ValueError beyond it
+        - returns: CoverageMap
+        """
+
+        if resolution is None:
+            resolution = min(self.spot.width, self.spot.height) / 20
+
+        # Grid covering the sample outline
+        outline = sample.outline(tolerance=resolution / 2)
+        x_min, y_min = outline.min(axis=1)
+        x_max, y_max = outline.max(axis=1)
+
+        nx = max(int(np.ceil((x_max - x_min) / resolution)), 1)
+        ny = max(int(np.ceil((y_max - y_min) / resolution)), 1)
+        x_max = x_min + nx * resolution
+        y_max = y_min + ny * resolution
+
+        if nx * ny > max_grid_cells:
+            raise ValueError(
+                f"Coverage grid of {nx} x {ny} cells exceeds max_grid_cells={max_grid_cells}, "
+                f"use a resolution of at least {resolution * np.sqrt(nx * ny / max_grid_cells):.3g}"
+            )
+
+        x_cells = x_min + (np.arange(nx) + 0.5) * resolution
+        y_cells = y_min + (np.arange(ny) + 0.5) * resolution
+
+        # Spot ellipse, semi-axes and bounding box half sides
+        a = 0.5 * self.spot.width
+        b = 0.5 * self.spot.height
+        rad = np.deg2rad(self.spot.angle)
+        cos, sin = np.cos(rad), np.sin(rad)
+        half_x = np.hypot(a * cos, b * sin)
+        half_y = np.hypot(a * sin, b * cos)
+
+        kx = int(np.ceil(2 * half_x / resolution)) + 1
+        ky = int(np.ceil(2 * half_y / resolution)) + 1
+
+        # Spots with a bounding box outside the grid can not contribute
+        xy = self.map_pattern.xy_instrument()
+        keep = (
+            (xy[0] + half_x >= x_min) & (xy[0] - half_x <= x_max) &
+            (xy[1] + half_y >= y_min) & (xy[1] - half_y <= y_max)
+        )
+        xy = xy[:, keep]
+
+        counts = np.zeros(nx * ny, dtype=np.int32)
+        batch = max(max_cells // (kx * ky), 1)
+
+        for start in range(0, xy.shape[1], batch):
+            cx = xy[0, start:start + batch, np.newaxis]
+            cy = xy[1, start:start + batch, np.newaxis]
+
+            # Indices of the cells in the bounding box of each spot, [n, kx] and [n, ky]
+            cols = np.floor((cx - half_x - x_min) / resolution).astype(int) + np.arange(kx)
+            rows = np.floor((cy - half_y - y_min) / resolution).astype(int) + np.arange(ky)
+
+            # Cell centers relative to the spot center
+            dx = (x_min + (cols + 0.5) * resolution - cx)[:, np.newaxis, :]
+            dy = (y_min + (rows + 0.5) * resolution - cy)[:, :, np.newaxis]
+
+            u = (dx * cos + dy * sin) / a
+            v = (dy * cos - dx * sin) / b
+
+            inside = (u**2 + v**2 <= 1)
+            inside &= ((cols >= 0) & (cols < nx))[:, np.newaxis, :]
+            inside &= ((rows >= 0) & (rows < ny))[:, :, np.newaxis]
+
+            index = rows[:, :, np.newaxis] * nx + cols[:, np.newaxis, :]
+            index = index[inside]
+
+            # Only the span of cells hit by this batch, not the whole grid
+            if index.size > 0:
+                first = index.min()
+                hits = np.bincount(index - first)
+                counts[first:first + hits.size] += hits.astype(np.int32)
+
+        counts = counts.reshape(ny, nx)
+
+        # Clipping to the sample, block of rows by block of rows
+        sample_mask = np.empty((ny, nx), dtype=bool)
+        block = max(max_cells // nx, 1)
+
+        for start in range(0, ny, block):
+            y_block = y_cells[start:start + block]
+            grid_x = np.broadcast_to(x_cells, (len(y_block), nx))
+            grid_y = np.broadcast_to(y_block[:, np.newaxis], (len(y_block), nx))
+
+            sample_mask[start:start + block] = sample.contains(
+                np.array([grid_x.ravel(), grid_y.ravel()])
+            ).reshape(len(y_block), nx)
+
+        counts[~sample_mask] = 0
+
+        return CoverageMap(
+            counts=counts,
+            sample_mask=sample_mask,
+            extent=(x_min, x_max, y_min, y_max),
+            resolution=resolution,
+        )
+
+
+    def stage_collisions(self, geometry, layers:list[str]=None, max_feature_size:float=None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Checks the spot footprints against the stage features of a DXF drawing.
+
+        The footprint of a spot hits an edge when any feature line crosses
+        it, and lands in a hole when its center lies inside a closed feature
+        (e.g. a vacuum hole or slot). Candidate spot/feature pairs come from
+        spatial indices, the exact tests are vectorized over all candidates.
+
+        - geometry: DXF.StageGeometry, e.g. from DXF.load
+        - layers: layer names to check (default: all)
+        - max_feature_size: closed features with a larger bounding box diagonal
+            (e.g. the outer stage outline) are not treated as holes
+        - returns: (edge, hole)
+            edge: np.ndarray of bool [N], True where a feature line crosses the footprint
+            hole: np.ndarray of bool [N], True where the spot center is inside a closed feature
+        """
+
+        xy = self.map_pattern.xy_instrument()
+        n = xy.shape[1]
+
+        a = 0.5 * self.spot.width
+        b = 0.5 * self.spot.height
+        semi_major = max(a, b)
+
+        edge = np.zeros(n, dtype=bool)
+        hole = np.zeros(n, dtype=bool)
+
+        segments, polyline = geometry.segments(layers, return_polyline=True)
+        if n == 0 or len(segments) == 0:
+            return edge, hole
+
+        # Long segments are split into pieces no longer than the spot major,
+        # so a piece crossing a footprint has its midpoint close to the center
+        start, end = segments[:, 0], segments[:, 1]
+        pieces = np.maximum(np.ceil(np.hypot(*(end - start).T) / (2 * semi_major)), 1).astype(int)
+        owner = np.repeat(np.arange(len(segments)), pieces)
+        t0 = (np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)) / pieces[owner]
+        t1 = t0 + 1 / pieces[owner]
+
+        direction = (end - start)[owner]
+        p0 = start[owner] + t0[:, np.newaxis] * direction
+        p1 = start[owner] + t1[:, np.newaxis] * direction
+
+        index = GridIndex(((p0 + p1) / 2).T, 2 * semi_major)
+        spot, piece = index.query(xy, 2 * semi_major)
+
+        # Exact test in the frame where the footprint is the unit circle
+        to_unit = Affine.rotation(-self.spot.angle).scale(1 / a, 1 / b)
+        q0 = to_unit.apply(p0[piece].T - xy[:, spot])
+        q1 = to_unit.apply(p1[piece].T - xy[:, spot])
+
+        d = q1 - q0
+        length2 = (d**2).sum(axis=0)
+        t = np.clip(-(q0 * d).sum(axis=0) / np.where(length2 > 0, length2, 1), 0, 1)
+        hit = ((q0 + t * d)**2).sum(axis=0) <= 1
+
+        edge[spot[hit]] = True
+
+        # Spot centers inside closed features, by ray casting against the
+        # segments of the candidate features only
+        closed = np.unique(polyline[geometry.closed[polyline]])
+        if len(closed) == 0:
+            return edge, hole
+
+        low = np.minimum.reduceat(geometry.vertices, geometry.offsets[:-1], axis=0)[closed]
+        high = np.maximum.reduceat(geometry.vertices, geometry.offsets[:-1], axis=0)[closed]
+
+        if max_feature_size is not None:
+            small = np.hypot(*(high - low).T) <= max_feature_size
+            closed, low, high = closed[small], low[small], high[small]
+
+        if len(closed) == 0:
+            return edge, hole
+
+        feature, spot = self.index().query_boxes(low.T, high.T)
+
+        # Expand every candidate (spot, feature) pair over the feature's segments
+        order = np.argsort(polyline, kind='stable')
+        first = np.searchsorted(polyline[order], closed)
+        count = np.searchsorted(polyline[order], closed, side='right') - first
+
+        repeats = count[feature]
+        pair = np.repeat(np.arange(len(feature)), repeats)
+        position = np.repeat(first[feature] - np.cumsum(repeats) + repeats, repeats) + np.arange(repeats.sum())
+        s0 = segments[order[position], 0]
+        s1 = segments[order[position], 1]
+
+        cx, cy = xy[0, spot[pair]], xy[1, spot[pair]]
+        straddles = (s0[:, 1] > cy) != (s1[:, 1] > cy)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = s0[:, 0] + (cy - s0[:, 1]) * (s1[:, 0] - s0[:, 0]) / (s1[:, 1] - s0[:, 1])
+        crossings = np.bincount(pair, weights=straddles & (cx < x_cross), minlength=len(feature))
+
+        hole[spot[crossings % 2 == 1]] = True
+
+        return edge, hole
+
+
+    def plot(self, axes:Axes, as_ellipse=False, max_ellipses:int=5000, **kwargs) -> None:
         """
-        Returns a list of Ellipse objects centered on the coordiantes specified in the supplied MapPatternf
+        Plots the spots centered on the coordinates specified in the supplied MapPattern
 
-        NOTE: Offset in the map pattern is applied prior to creating the Ellipse object
+        All footprints are drawn as a single EllipseCollection, styled with
+        patch keywords such as Templates.SPOT.
+
+        - axes: axes handle to plot in/on
+        - as_ellipse: plot the spot footprints instead of markers
+        - max_ellipses: above this number of spots the footprints are drawn
+            as scatter markers (level of detail)
+
+        NOTE: Offset in the map pattern is applied prior to plotting
         """
         
-        # Setting major and minor of Ellipse object
+        # Setting major and minor of the footprints
         major = self.spot.elongation()
         minor = self.spot.diameter
 
         xy = self.map_pattern.xy_instrument()  # Applying offset
         
-        if as_ellipse:
-            for row in xy.T:
-                ellipse = Ellipse(width=major, height=minor)  # Creating object
-                ellipse.translate(row[0], row[1])  # Centering ellipse on map pattern
+        if as_ellipse and self.map_pattern.count() <= max_ellipses:
+            collection = EllipseCollection(
+                widths=major,
+                heights=minor,
+                angles=self.spot.angle,
+                units='xy',
+                offsets=xy.T,
+                offset_transform=axes.transData,
+                **collection_style(kwargs)
+            )
+            axes.add_collection(collection, autolim=False)
+
+            # Data limits covering the full footprints, not only their centers
+            if xy.shape[1] > 0:
+                footprint = self.spot.outline() - self.spot.center[:, np.newaxis]
+                axes.update_datalim([
+                    xy.min(axis=1) + footprint.min(axis=1),
+                    xy.max(axis=1) + footprint.max(axis=1),
+                ])
+                axes.autoscale_view()
 
-                ellipse.plot(axes, as_patch=True, **kwargs)
+        elif as_ellipse:
+            style = collection_style(kwargs)
+            style.setdefault('zorder', 10)
+            axes.scatter(xy[0,:], xy[1,:], **style)
         
         else:
             axes.scatter(xy[0,:], xy[1,:], zorder=10)
@@ -159,6 +1001,132 @@ class SpotCollection:
 
 
 
+def _packing_lattice_(sample:Shape, spot:Spot, edge_exclusion:float, scale:float, rotation:float, phase:tuple[float, float]) -> np.ndarray:
+    """
+    Returns the centers (instrument coordinates) of a hexagonal packing of
+    'spot' footprints that lie entirely inside 'sample', dimension [2, N].
+
+    In the frame where the footprint is a circle of diameter 1, the
+    centers form a hexagonal lattice of pitch 'scale' (>= 1, so footprints
+    never overlap), rotated 'rotation' degrees and shifted by 'phase'
+    (fractions of the lattice vectors).
+    """
+    origin = sample.outline().mean(axis=1)
+
+    lattice = (
+        Affine.translation(*phase)
+        .then(Affine([[1, 0.5, 0], [0, np.sqrt(3) / 2, 0], [0, 0, 1]]))
+        .rotate(rotation)
+        .scale(scale * spot.width, scale * spot.height)
+        .rotate(spot.angle)
+        .translate(*origin)
+    )
+
+    # Lattice indices covering the sample
+    ij = lattice.inverse().apply(sample.outline(tolerance=0.1 * spot.height))
+    i = np.arange(np.floor(ij[0].min()) - 1, np.ceil(ij[0].max()) + 2)
+    j = np.arange(np.floor(ij[1].min()) - 1, np.ceil(ij[1].max()) + 2)
+    i, j = np.meshgrid(i, j)
+
+    xy = lattice.apply(np.array([i.ravel(), j.ravel()]))
+
+    # The footprint contains its inscribed circle and lies within its
+    # circumscribed circle, so only centers in between need the full test
+    distance = sample.signed_distance(xy)
+    inside = distance <= -(edge_exclusion + 0.5 * max(spot.width, spot.height))
+    border = ~inside & (distance <= -(edge_exclusion + 0.5 * min(spot.width, spot.height)))
+
+    if border.any():
+        border_spots = SpotCollection(MapPattern(*xy[:, border], 0, 0, 0), spot)
+        inside[border] = border_spots.inside(sample, margin=edge_exclusion)[0]
+
+    return xy[:, inside]
+
+
+def _best_packing_(sample:Shape, spot:Spot, edge_exclusion:float, scale:float, n_rotations:int, n_phases:int) -> np.ndarray:
+    """
+    Returns the packing with the most footprints over all lattice rotations and phases
+    """
+    best = np.zeros((2, 0))
+
+    for rotation in np.linspace(0, 60, n_rotations, endpoint=False):
+        for phase_i in np.arange(n_phases) / n_phases:
+            for phase_j in np.arange(n_phases) / n_phases:
+                xy = _packing_lattice_(sample, spot, edge_exclusion, scale, rotation, (phase_i, phase_j))
+
+                if xy.shape[1] > best.shape[1]:
+                    best = xy
+
+    return best
+
+
+def pack_spots(
+        sample:Shape,
+        spot:Spot,
+        edge_exclusion:float=0.0,
+        target_coverage:float=None,
+        n_rotations:int=6,
+        n_phases:int=4,
+        gap:float=1e-6,
+        x_offset:float=0.0,
+        y_offset:float=0.0,
+        theta_offset:float=0.0,
+    ) -> MapPattern:
+    """
+    Creates a MapPattern of non-overlapping spot footprints, all entirely
+    inside the sample and its edge exclusion.
+
+    Equal, equally rotated ellipses pack densest as the affine image of the
+    hexagonal circle packing, so the candidates are hexagonal lattices
+    stretched along the spot major. The lattice rotation and phase with
+    the most footprints inside the sample is chosen, every candidate is
+    evaluated for all its points at once.
+
+    - sample: outline of the sample in instrument coordinates
+    - spot: beam spot, its width (major) and angle set the stretch of the lattice
+    - edge_exclusion: distance the footprints must keep from the sample edge
+    - target_coverage: fraction of the sample area to measure. Instead of the
+        densest packing, the lattice is spread out to the fewest points that
+        still cover this fraction
+    - n_rotations: lattice rotations tried, between 0 and 60 degrees
+    - n_phases: lattice shifts tried along each lattice vector
+    - gap: clearance between neighbouring footprints, as a fraction of the
+        footprint size, so rounding never makes touching footprints overlap
+    - x_offset, y_offset, theta_offset: offsets of the returned MapPattern
+    - returns: MapPattern
+    """
+    pitch = 1.0 + gap
+    xy = _best_packing_(sample, spot, edge_exclusion, pitch, n_rotations, n_phases)
+
+    if target_coverage is not None:
+        covered = spot.area() / sample.area()
+        coverage = xy.shape[1] * covered
+
+        if coverage < target_coverage:
+            print(f"WARNING: Densest packing covers {coverage:.1%} of the sample, below the target {target_coverage:.1%}")
+
+        else:
+            # Largest lattice pitch still reaching the target, coverage falls
+            # roughly with the square of the pitch
+            low, high = pitch, 2 * pitch * np.sqrt(coverage / target_coverage)
+
+            for _ in range(12):
+                scale = 0.5 * (low + high)
+                candidate = _best_packing_(sample, spot, edge_exclusion, scale, n_rotations, n_phases)
+
+                if candidate.shape[1] * covered >= target_coverage:
+                    low, xy = scale, candidate
+                else:
+                    high = scale
+
+    xy_pattern = Affine.rotation(theta_offset).translate(x_offset, y_offset).inverse().apply(xy)
+
+    return MapPattern(xy_pattern[0], xy_pattern[1], x_offset, y_offset, theta_offset)
+
+
+
+
+
 if __name__ == '__main__':
     import matplotlib.pyplot as plt
     import Templates as Temp
@@ -192,7 +1160,7 @@ if __name__ == '__main__':
 
     fig, ax = plt.subplots()
     
-    DXF.plot(stage_file, ax, **Temp.STAGE)
+    DXF.plot(stage_file, ax, cache=True, **Temp.STAGE)
 
     sector.plot(ax, as_patch=True, **Temp.SAMPLE)
 
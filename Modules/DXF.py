@@ -1,8 +1,44 @@
 import ezdxf
 import ezdxf.entities
+import ezdxf.path
+from ezdxf.addons import iterdxf
+import numpy as np
 from matplotlib.axes import Axes
+from matplotlib.collections import LineCollection
 from matplotlib.patches import Arc, Circle, Patch, Polygon
 
+import os
+import sys
+# Get the current script's directory
+current_dir = os.path.dirname(os.path.abspath(__file__))
+# Get the parent directory by going one level up
+parent_dir = os.path.dirname(current_dir)
+# Add the parent directory to sys.path
+sys.path.append(parent_dir)
+
+from Modules.ShapeShadow import arc_points
+from Utilities import Cache
+from Modules.Templates import collection_style
+
+
+# Entity types converted to geometry, INSERT (block references) are expanded
+SUPPORTED_ENTITIES = [
+    'ARC',
+    'CIRCLE',
+    'ELLIPSE',
+    'LINE',
+    'LWPOLYLINE',
+    'POLYLINE',
+    'SPLINE',
+    'INSERT',
+]
+
+# Default maximum distance between a curve and its tessellation, in drawing units
+TOLERANCE = 0.01
+
+# Version of the cached geometry layout, cache files of other versions are rebuilt
+CACHE_VERSION = 2
+
 
 def add_arc(arc:ezdxf.entities.Arc, **kwargs) -> Patch:
     """
@@ -14,11 +50,11 @@ def add_arc(arc:ezdxf.entities.Arc, **kwargs) -> Patch:
     end_angle = arc.dxf.end_angle
 
     return Arc(
-        center, 
-        width=2*radius, 
-        height=2*radius, 
-        angle=0, 
-        theta1=start_angle, 
+        center,
+        width=2*radius,
+        height=2*radius,
+        angle=0,
+        theta1=start_angle,
         theta2=end_angle,
         **kwargs,
     )
@@ -46,21 +82,396 @@ def add_line(line:ezdxf.entities.Line, **kwargs) -> Patch:
     )
 
 
-def plot(dxf_filename:str, ax_handle:Axes, **kwargs) -> None:
-    doc = ezdxf.readfile(dxf_filename)    
-    msp = doc.modelspace()
-
-    for entity in msp:
-        if entity.dxftype() == "ARC":
-            arc = add_arc(entity, **kwargs)
-            ax_handle.add_patch(arc)
-        
-        elif entity.dxftype() == "CIRCLE":
-            circle = add_circle(entity, **kwargs)
-            ax_handle.add_patch(circle)
-        
-        elif entity.dxftype() == "LINE":
-            line = add_line(entity, **kwargs)
-            ax_handle.add_patch(line)
-
-    return None        
\ No newline at end of file
+#----------------------------------------------------------------
+# Tessellation
+#----------------------------------------------------------------
+
+
+def _arc_vertices_(center, radius:float, start_angle:float, end_angle:float, tolerance:float) -> np.ndarray:
+    """
+    Returns the vertices of an arc, counter-clockwise from 'start_angle' to
+    'end_angle' (degrees), dimension [K, 2]
+    """
+    sweep = (end_angle - start_angle) % 360
+    if sweep == 0:
+        sweep = 360
+
+    n = arc_points(radius, sweep, tolerance)
+    angle = np.deg2rad(start_angle + np.linspace(0, sweep, n))
+
+    return np.column_stack([
+        center[0] + radius * np.cos(angle),
+        center[1] + radius * np.sin(angle),
+    ])
+
+
+def _is_ocs_flipped_(entity) -> bool:
+    """
+    Checks whether the entity lies in a mirrored object coordinate system,
+    which the fast paths below do not handle
+    """
+    extrusion = entity.dxf.get('extrusion', None)
+
+    return extrusion is not None and extrusion[2] < 0
+
+
+def tessellate(entity, tolerance:float=TOLERANCE) -> list[tuple[np.ndarray, bool]]:
+    """
+    Converts a DXF entity to polylines.
+
+    LINE, ARC, CIRCLE and straight LWPOLYLINE entities are converted directly,
+    all other supported entities through ezdxf's path flattening.
+
+    - entity: DXF entity, one of SUPPORTED_ENTITIES except INSERT
+    - tolerance: maximum distance between a curve and its tessellation
+    - returns: list of (vertices [K, 2], closed), closed polylines repeat
+        their first vertex at the end
+    """
+    dxftype = entity.dxftype()
+
+    if dxftype == 'LINE':
+        start, end = entity.dxf.start, entity.dxf.end
+        return [(np.array([[start.x, start.y], [end.x, end.y]]), False)]
+
+    if dxftype == 'CIRCLE' and not _is_ocs_flipped_(entity):
+        center = entity.dxf.center
+        vertices = _arc_vertices_(center, entity.dxf.radius, 0, 360, tolerance)
+        return [(vertices, True)]
+
+    if dxftype == 'ARC' and not _is_ocs_flipped_(entity):
+        vertices = _arc_vertices_(
+            entity.dxf.center,
+            entity.dxf.radius,
+            entity.dxf.start_angle,
+            entity.dxf.end_angle,
+            tolerance,
+        )
+        return [(vertices, False)]
+
+    if dxftype == 'LWPOLYLINE' and not entity.has_arc and not _is_ocs_flipped_(entity):
+        vertices = np.array(entity.get_points('xy'), dtype=float).reshape(-1, 2)
+        closed = bool(entity.closed)
+        if closed and len(vertices) > 0:
+            vertices = np.vstack([vertices, vertices[:1]])
+        return [(vertices, closed)]
+
+    polylines = []
+    for path in ezdxf.path.make_path(entity).sub_paths():
+        vertices = np.array([(v.x, v.y) for v in path.flattening(tolerance)], dtype=float).reshape(-1, 2)
+        polylines.append((vertices, path.is_closed))
+
+    return polylines
+
+
+def _iter_entities_(entities, types:list[str], layer:str=None):
+    """
+    Yields (entity, layer) for all entities, expanding INSERT entities into
+    the entities of their block. Block entities on layer '0' inherit the
+    layer of the INSERT.
+    """
+    for entity in entities:
+        dxftype = entity.dxftype()
+        entity_layer = entity.dxf.get('layer', '0')
+
+        if layer is not None and entity_layer == '0':
+            entity_layer = layer
+
+        if dxftype == 'INSERT':
+            if 'INSERT' in types:
+                yield from _iter_entities_(entity.virtual_entities(), types, entity_layer)
+
+        elif dxftype in types:
+            yield entity, entity_layer
+
+
+
+def _intersects_(polyline:np.ndarray, bbox:tuple[float, float, float, float]) -> bool:
+    """
+    Checks whether the bounding box of 'polyline' intersects 'bbox'
+    """
+    x_min, x_max, y_min, y_max = bbox
+    low = polyline.min(axis=0)
+    high = polyline.max(axis=0)
+
+    return low[0] <= x_max and high[0] >= x_min and low[1] <= y_max and high[1] >= y_min
+
+
+
+class StageGeometry:
+    """
+    Tessellated DXF geometry stored as flat arrays.
+
+    Polyline k consists of vertices[offsets[k]:offsets[k+1]], lies on
+    layer layers[layer_index[k]] and is closed if closed[k].
+    """
+
+    def __init__(self, vertices:np.ndarray, offsets:np.ndarray, layer_index:np.ndarray, layers:list[str], closed:np.ndarray) -> None:
+        """
+        - vertices: vertices of all polylines, dimension [M, 2]
+        - offsets: start of every polyline in 'vertices' and the total count, dimension [K + 1]
+        - layer_index: index into 'layers' for every polyline, dimension [K]
+        - layers: names of the layers
+        - closed: whether each polyline is closed, dimension [K]
+        """
+        self.vertices = vertices
+        self.offsets = offsets
+        self.layer_index = layer_index
+        self.layers = list(layers)
+        self.closed = closed
+
+        return None
+
+
+    @classmethod
+    def from_entities(
+            cls,
+            entities,
+            types:list[str]=None,
+            tolerance:float=TOLERANCE,
+            layers:list[str]=None,
+            bbox:tuple[float, float, float, float]=None,
+        ):
+        """
+        Tessellates DXF entities, e.g. a modelspace.
+
+        Entities are processed one at a time and only the geometry passing
+        the filters is kept, so 'entities' may be a stream.
+
+        - entities: iterable of DXF entities
+        - types: entity types to include (default: SUPPORTED_ENTITIES)
+        - tolerance: maximum distance between a curve and its tessellation
+        - layers: layer names to include (default: all)
+        - bbox: (x_min, x_max, y_min, y_max), polylines entirely outside are dropped
+        """
+        if types is None:
+            types = SUPPORTED_ENTITIES
+
+        if layers is not None:
+            layers = set(layers)
+
+        layer_names: dict[str, int] = {}
+        vertices, lengths, layer_index, closed = [], [], [], []
+
+        for entity, layer in _iter_entities_(entities, types):
+            if layers is not None and layer not in layers:
+                continue
+
+            for polyline, is_closed in tessellate(entity, tolerance):
+                if len(polyline) < 2:
+                    continue
+
+                if bbox is not None and not _intersects_(polyline, bbox):
+                    continue
+
+                vertices.append(polyline)
+                lengths.append(len(polyline))
+                layer_index.append(layer_names.setdefault(layer, len(layer_names)))
+                closed.append(is_closed)
+
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        return cls(
+            vertices=np.concatenate(vertices) if vertices else np.zeros((0, 2)),
+            offsets=offsets,
+            layer_index=np.array(layer_index, dtype=np.int32),
+            layers=list(layer_names),
+            closed=np.array(closed, dtype=bool),
+        )
+
+
+    @classmethod
+    def from_arrays(cls, arrays:dict[str, np.ndarray]):
+        """
+        Creates the geometry from arrays written by 'to_arrays'
+        """
+        return cls(
+            vertices=arrays['vertices'],
+            offsets=arrays['offsets'],
+            layer_index=arrays['layer_index'],
+            layers=[str(layer) for layer in arrays['layers']],
+            closed=arrays['closed'],
+        )
+
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """
+        Returns the geometry as a dictionary of arrays, e.g. for np.savez
+        """
+        return {
+            'vertices': np.asarray(self.vertices, dtype=float).reshape(-1, 2),
+            'offsets': np.asarray(self.offsets, dtype=np.int64),
+            'layer_index': np.asarray(self.layer_index, dtype=np.int32),
+            'layers': np.array(self.layers, dtype=str),
+            'closed': np.asarray(self.closed, dtype=bool),
+        }
+
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+
+    def _selection_(self, layer:str|list[str]=None) -> np.ndarray:
+        """
+        Returns the indices of the polylines on 'layer', one name or a list
+        of names (default: all)
+        """
+        if layer is None:
+            return np.arange(len(self))
+
+        if isinstance(layer, str):
+            layer = [layer]
+
+        selected = [self.layers.index(name) for name in layer if name in self.layers]
+
+        return np.flatnonzero(np.isin(self.layer_index, selected))
+
+
+    def polylines(self, layer:str|list[str]=None) -> list[np.ndarray]:
+        """
+        Returns the polylines on 'layer' (default: all) as views into 'vertices'
+        """
+        index = self._selection_(layer)
+
+        return [self.vertices[a:b] for a, b in zip(self.offsets[index], self.offsets[index + 1])]
+
+
+    def segments(self, layer:str|list[str]=None, return_polyline:bool=False) -> np.ndarray:
+        """
+        Returns all line segments on 'layer' (default: all), dimension [S, 2, 2]
+
+        - return_polyline: also return the index of the polyline of every segment
+        """
+        index = self._selection_(layer)
+
+        # Every vertex except the last one of its polyline starts a segment
+        start = self.offsets[index]
+        stop = self.offsets[index + 1] - 1
+        counts = np.maximum(stop - start, 0)
+        first = np.repeat(start - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+        segments = np.stack([self.vertices[first], self.vertices[first + 1]], axis=1)
+
+        if return_polyline:
+            return segments, np.repeat(index, counts)
+
+        return segments
+
+
+    def bounds(self) -> tuple[float, float, float, float]:
+        """
+        Returns (x_min, x_max, y_min, y_max) of the geometry
+        """
+        if len(self.vertices) == 0:
+            return (np.nan, np.nan, np.nan, np.nan)
+
+        x_min, y_min = self.vertices.min(axis=0)
+        x_max, y_max = self.vertices.max(axis=0)
+
+        return (x_min, x_max, y_min, y_max)
+
+
+    def plot(self, ax_handle:Axes, **kwargs) -> None:
+        """
+        Plots the geometry as one LineCollection per layer
+
+        - kwargs: patch style, e.g. Templates.STAGE
+        """
+        style = collection_style(kwargs)
+
+        for layer in self.layers:
+            collection = LineCollection(self.polylines(layer), label=layer, **style)
+            ax_handle.add_collection(collection)
+
+        ax_handle.autoscale_view()
+
+        return None
+
+
+
+def iter_modelspace(dxf_filename:str, types:list[str]=None):
+    """
+    Streams the modelspace entities of a DXF file without loading the
+    document, so memory use does not grow with the file size.
+
+    NOTE: Block definitions are not available while streaming, INSERT
+    entities are therefore not expanded.
+    """
+    if types is None:
+        types = SUPPORTED_ENTITIES
+
+    # iterdxf.single_pass_modelspace drops the last entity of the modelspace
+    # when it is a simple entity (LINE, CIRCLE, ...), iterdxf.modelspace does not
+    yield from iterdxf.modelspace(dxf_filename, types=[t for t in types if t != 'INSERT'])
+
+
+def load(
+        dxf_filename:str,
+        tolerance:float=TOLERANCE,
+        cache:bool=False,
+        cache_dir:str=None,
+        layers:list[str]=None,
+        types:list[str]=None,
+        bbox:tuple[float, float, float, float]=None,
+        stream:bool=False,
+    ) -> StageGeometry:
+    """
+    Reads a DXF file and tessellates all supported entities of the modelspace
+
+    - tolerance: maximum distance between a curve and its tessellation
+    - cache: store the tessellated geometry in an *.npz file and memory-map
+        it on later calls, as long as the DXF file is unchanged
+    - cache_dir: directory of the cache files (default: Cache.DEFAULT_CACHE_DIR)
+    - layers: layer names to include (default: all)
+    - types: entity types to include (default: SUPPORTED_ENTITIES)
+    - bbox: (x_min, x_max, y_min, y_max), e.g. around the sample area,
+        geometry entirely outside is dropped
+    - stream: read the file entity by entity instead of loading the whole
+        document, for very large drawings (see 'iter_modelspace')
+    """
+    if cache:
+        path = Cache.cache_filename(
+            dxf_filename,
+            cache_dir,
+            tolerance=tolerance,
+            version=CACHE_VERSION,
+            layers=None if layers is None else sorted(layers),
+            types=None if types is None else sorted(types),
+            bbox=None if bbox is None else tuple(float(b) for b in bbox),
+            stream=stream,
+        )
+
+        arrays = Cache.load_fresh(path, dxf_filename)
+        if arrays is not None:
+            return StageGeometry.from_arrays(arrays)
+
+    if stream:
+        entities = iter_modelspace(dxf_filename, types)
+    else:
+        entities = ezdxf.readfile(dxf_filename).modelspace()
+
+    geometry = StageGeometry.from_entities(
+        entities,
+        types=types,
+        tolerance=tolerance,
+        layers=layers,
+        bbox=bbox,
+    )
+
+    if cache:
+        Cache.save_npz(path, geometry.to_arrays() | Cache.file_metadata(dxf_filename))
+
+    return geometry
+
+
+def plot(dxf_filename:str, ax_handle:Axes, cache:bool=False, **kwargs) -> None:
+    """
+    Plots the DXF file with one LineCollection per layer
+
+    - cache: use the geometry cache, see 'load'
+    - kwargs: patch style, e.g. Templates.STAGE
+    """
+    geometry = load(dxf_filename, cache=cache)
+    geometry.plot(ax_handle, **kwargs)
+
+    return None
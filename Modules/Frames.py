@@ -0,0 +1,142 @@
+import numpy as np
+import pandas as pd
+
+import os
+import sys
+# Get the current script's directory
+current_dir = os.path.dirname(os.path.abspath(__file__))
+# Get the parent directory by going one level up
+parent_dir = os.path.dirname(current_dir)
+# Add the parent directory to sys.path
+sys.path.append(parent_dir)
+
+from Utilities.Transform import Affine
+
+
+# Name of the reference frame all other frames are defined against
+INSTRUMENT = 'instrument'
+
+
+class FrameRegistry:
+    """
+    Registry of coordinate frames.
+
+    Every frame is defined by the transformation taking coordinates in
+    that frame to instrument coordinates. Transformations between any two
+    frames (and their inverses) are computed once and cached until a
+    frame is (re)registered.
+    """
+
+    def __init__(self) -> None:
+        self._frames: dict[str, Affine] = {INSTRUMENT: Affine()}
+        self._cache: dict[tuple[str, str], Affine] = {}
+
+        return None
+
+
+    @classmethod
+    def from_scan_file(cls, scan_file):
+        """
+        Creates a registry from the 'Offsets' and 'Alignment' of a ScanFile.
+
+        Frames:
+        - 'instrument': stage coordinates, as in the *.txt exports
+        - 'sample': pattern coordinates, rotated by the theta offset and
+            translated by the x/y offset (same as MapPattern.xy_instrument)
+        - 'alignment': instrument axes with origin at the alignment position
+        """
+        registry = cls()
+
+        offsets = scan_file.offsets
+        registry.register(
+            'sample',
+            Affine.rotation(offsets.theta).translate(offsets.x, offsets.y)
+        )
+
+        alignment = scan_file.alignment
+        registry.register(
+            'alignment',
+            Affine.translation(alignment.x, alignment.y)
+        )
+
+        return registry
+
+
+    def register(self, name:str, transform:Affine):
+        """
+        Registers (or replaces) frame 'name'
+
+        - name: name of the frame
+        - transform: transformation from the frame to instrument coordinates
+        """
+        if name == INSTRUMENT:
+            raise ValueError(f"The '{INSTRUMENT}' frame can not be redefined")
+
+        self._frames[name] = transform
+        self._cache.clear()
+
+        return self
+
+
+    def frames(self) -> list[str]:
+        """
+        Returns the names of the registered frames
+        """
+        return list(self._frames)
+
+
+    def transform(self, source:str, target:str) -> Affine:
+        """
+        Returns the (cached) transformation from frame 'source' to frame 'target'
+        """
+        key = (source, target)
+
+        if key not in self._cache:
+            for name in key:
+                if name not in self._frames:
+                    raise KeyError(f"Unknown frame: '{name}', registered frames are; {self.frames()}")
+
+            forward = self._frames[target].inverse() @ self._frames[source]
+
+            self._cache[key] = forward
+            self._cache[(target, source)] = forward.inverse()
+
+        return self._cache[key]
+
+
+    def apply(self, xy:np.ndarray, source:str, target:str, out:np.ndarray=None, dtype=None) -> np.ndarray:
+        """
+        Maps coordinates from frame 'source' to frame 'target'
+
+        - xy: np.ndarray dimension [2, N]
+        - out: optional output buffer, may be 'xy' itself
+        - dtype: optional floating point type of the result
+        - returns: np.ndarray dimension [2, N]
+        """
+        return self.transform(source, target).apply(xy, out=out, dtype=dtype)
+
+
+    def apply_dataframe(
+            self,
+            dataframe:pd.DataFrame,
+            source:str=INSTRUMENT,
+            target:str='sample',
+            columns:tuple[str, str]=('x', 'y'),
+        ) -> pd.DataFrame:
+        """
+        Maps the coordinate columns of 'dataframe' from frame 'source' to
+        frame 'target', overwriting the columns in place.
+
+        - dataframe: e.g. the result of JAW.read_text_file
+        - columns: names of the x and y columns
+        - returns: the same DataFrame
+        """
+        x_col, y_col = columns
+
+        xy = dataframe[[x_col, y_col]].to_numpy(dtype=float, copy=True).T
+        self.apply(xy, source, target, out=xy)
+
+        dataframe[x_col] = xy[0]
+        dataframe[y_col] = xy[1]
+
+        return dataframe
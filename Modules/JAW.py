@@ -1,5 +1,13 @@
+import asyncio
+import fnmatch
+import glob
 import os
+import time
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import partial
 
 import os
 import sys
@@ -9,15 +17,23 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 
 # Add the current directory to sys.path
 sys.path.append(current_dir)
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(current_dir))
 
-from Readers._text_reader import text_reader
+from collections.abc import Callable, Iterator
+from Readers import _text_reader
+from Readers._text_reader import TextFileTail, compact_dtypes, iter_text_file as _iter_text_file, text_reader
 from Readers._scan_reader import ScanFile, scan_reader
+from Utilities import Cache
 
 
 # Ellipsometer specific constants
 BEAM_SIZE_WITH_FOCUS_PROBES = 0.03
 BEAM_SIZE_WITHOUT_FOCUS_PROBES = 0.3
 
+# Version of the cached reader output, cache files of other versions are re-parsed
+CACHE_VERSION = 2
+
 
 def is_valid(filename:str) -> bool:
     """
@@ -34,14 +50,56 @@ def is_valid(filename:str) -> bool:
     if not os.path.exists(filename):
         raise FileNotFoundError(f"Could not find file:\n{filename}")
     
-    # Check for correct file extension
+    # Check for correct file extension, case insensitive
     _, file_extension = os.path.splitext(filename)
-    if file_extension not in ', '.join(SUPPORTED_FILE_EXTENSIONS):
+    supported = {pattern.lstrip('*').lower() for pattern in SUPPORTED_FILE_EXTENSIONS}
+    if file_extension.lower() not in supported:
         raise ValueError(f"Unsupported file type, supported files are; {SUPPORTED_FILE_EXTENSIONS}, were given; {file_extension}.")
     
     return True
 
 
+def _cached_(
+        filename:str,
+        parse:Callable,
+        to_arrays:Callable,
+        from_arrays:Callable,
+        cache_dir:str=None,
+        max_bytes:int=None,
+        **key,
+    ):
+    """
+    Returns 'from_arrays' of the cached result of 'parse(filename)', parsing
+    and caching it first when missing or outdated. Cache files are keyed by
+    path and 'key' (reader and options) and checked against the modification
+    time and content hash of 'filename'.
+    """
+    path = Cache.cache_filename(filename, cache_dir, version=CACHE_VERSION, **key)
+
+    arrays = Cache.load_fresh(path, filename)
+    if arrays is not None:
+        return from_arrays(arrays)
+
+    result = parse(filename)
+
+    Cache.save_npz(
+        path,
+        to_arrays(result) | Cache.file_metadata(filename),
+        max_bytes=Cache.DEFAULT_MAX_BYTES if max_bytes is None else max_bytes,
+    )
+
+    return result
+
+
+def invalidate(filename:str=None, cache_dir:str=None) -> list[str]:
+    """
+    Removes the cached results of 'filename', or of every file if not given.
+
+    - returns: removed cache files
+    """
+    return Cache.invalidate(filename, cache_dir)
+
+
 #----------------------------------------------------------------
 # *.txt file reader
 #----------------------------------------------------------------
@@ -49,36 +107,411 @@ def is_valid(filename:str) -> bool:
 # Types of supported file formats
 SUPPORTED_FILE_EXTENSIONS = [
     '*.txt',
+    '*.SCAN',
 ]
 
 
-def read_text_file(filename:str) -> pd.DataFrame:
+def read_text_file(
+        filename:str,
+        cache:bool=False,
+        cache_dir:str=None,
+        max_bytes:int=None,
+        compact:bool=False,
+    ) -> pd.DataFrame:
     """
     Function for reading the text version of the J.A.Woollam *.SE files
 
     Headers are renamed according with the HEAD_NAMES
 
     NOTE: The x and y coordinates are extracted from the 1st column and saved in an x and y column.
+
+    - cache: store the parsed columns in an *.npz file and read them from
+        there on later calls, as long as the file is unchanged
+    - cache_dir: directory of the cache files (default: Cache.DEFAULT_CACHE_DIR)
+    - max_bytes: size limit of the cache directory, least recently used
+        files are removed beyond it (default: Cache.DEFAULT_MAX_BYTES)
+    - compact: float32 measurements, bool flags and small integer counts,
+        see 'compact_dtypes' (which also reports the memory saved per column)
     """
 
     # Check if filename is valid
     is_valid(filename)
 
-    dataframe = text_reader(filename)
+    if cache:
+        dataframe = _cached_(
+            filename,
+            text_reader,
+            _text_reader.to_arrays,
+            _text_reader.from_arrays,
+            cache_dir,
+            max_bytes,
+            reader='text',
+        )
+    else:
+        dataframe = text_reader(filename)
+
+    if compact:
+        dataframe = compact_dtypes(dataframe)
 
     return dataframe
 
 
+def iter_text_file(filename:str, chunksize:int=100_000, compact:bool=False) -> Iterator[pd.DataFrame]:
+    """
+    Function for reading the text version of the J.A.Woollam *.SE files in
+    chunks of 'chunksize' rows, for exports too large to hold at once.
+
+    Every chunk is formatted as with 'read_text_file'.
+    """
+
+    # Check if filename is valid, before the first chunk is requested
+    is_valid(filename)
+
+    if compact:
+        return map(compact_dtypes, _iter_text_file(filename, chunksize))
+
+    return _iter_text_file(filename, chunksize)
+
+
+def tail_text_file(filename:str, max_preamble_lines:int=1000) -> TextFileTail:
+    """
+    Function for following the text version of the J.A.Woollam *.SE files
+    while the map is still running.
+
+    The returned TextFileTail parses only the rows appended since its last
+    'poll', every increment is formatted as with 'read_text_file'.
+
+    - max_preamble_lines: lines without data before ValueError, see TextFileTail
+    """
+
+    # Check if filename is valid, before the first poll
+    is_valid(filename)
+
+    return TextFileTail(filename, max_preamble_lines=max_preamble_lines)
+
+
+def _expand_paths_(paths_or_glob:str|list[str], pattern:str='*.txt') -> list[str]:
+    """
+    Expands a directory (all files matching 'pattern' in it), a glob pattern
+    or a list of either into a sorted list of unique file names
+    """
+    if isinstance(paths_or_glob, (str, os.PathLike)):
+        paths_or_glob = [paths_or_glob]
+
+    filenames = []
+    for path in map(os.fspath, paths_or_glob):
+        if os.path.isdir(path):
+            filenames.extend(glob.glob(os.path.join(path, pattern)))
+        elif glob.has_magic(path):
+            filenames.extend(glob.glob(path))
+        else:
+            filenames.append(path)
+
+    return sorted(set(filenames))
+
+
+def _read_text_file_safe_(filename:str, **kwargs) -> tuple[pd.DataFrame, str]:
+    """
+    Reads a single file for 'read_many', the error is returned (not raised)
+    so one bad export does not abort the whole batch
+
+    - returns: dataframe and None, or None and the error message
+    """
+    try:
+        return read_text_file(filename, **kwargs), None
+
+    except Exception as error:
+        return None, f"{type(error).__name__}: {error}"
+
+
+def read_many(
+        paths_or_glob:str|list[str],
+        workers:int=None,
+        cache:bool=False,
+        cache_dir:str=None,
+        compact:bool=False,
+    ) -> tuple[pd.DataFrame, dict[str, str]]:
+    """
+    Function for reading many text versions of the J.A.Woollam *.SE files
+    in parallel, one file per task on a pool of 'workers' processes.
+
+    paths_or_glob: directory, glob pattern (e.g. 'exports/2024-*.txt') or list of files
+    workers: number of processes, defaults to the number of CPUs (1 reads in this process)
+    cache, cache_dir: parse cache of every file, see 'read_text_file'
+    compact: compact dtypes, see 'compact_dtypes'. Files are compacted by the
+        workers, so less data is sent back to this process
+
+    - returns: all files concatenated, with a categorical 'source_file' column,
+        and a dictionary of file name -> error message for the files that failed
+    """
+    filenames = _expand_paths_(paths_or_glob)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(filenames)))
+
+    read = partial(_read_text_file_safe_, cache=cache, cache_dir=cache_dir, compact=compact)
+
+    if workers == 1:
+        results = list(map(read, filenames))
+
+    else:
+        # Files are handed out in batches, so thousands of small files do not
+        # cost one round trip to the pool each
+        chunksize = max(1, len(filenames) // (4 * workers))
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(read, filenames, chunksize=chunksize))
+
+    # Categories are only the files that parsed, failed files are in 'errors'
+    frames, codes, parsed, errors = [], [], [], {}
+    for filename, (dataframe, error) in zip(filenames, results):
+        if error is not None:
+            errors[filename] = error
+            continue
+
+        frames.append(dataframe)
+        codes.append(np.full(len(dataframe), len(parsed), dtype=np.int32))
+        parsed.append(filename)
+
+    if len(frames) == 0:
+        return pd.DataFrame({'source_file': pd.Categorical([], categories=parsed)}), errors
+
+    dataframe = pd.concat(frames, ignore_index=True)
+    dataframe['source_file'] = pd.Categorical.from_codes(np.concatenate(codes), categories=parsed)
+
+    if compact:
+        # Categorical flags of files with different categories are
+        # concatenated as objects
+        dataframe = compact_dtypes(dataframe)
+
+    return dataframe, errors
+
+
 #----------------------------------------------------------------
 # *.SCAN file_reader
 #----------------------------------------------------------------
 
 
-def read_scan_file(filename:str) -> ScanFile:
+def read_scan_file(filename:str, cache:bool=False, cache_dir:str=None, max_bytes:int=None) -> ScanFile:
+    """
+    Function for reading the J.A.Woollam *.SCAN recipe files
+
+    - cache, cache_dir, max_bytes: parse cache, see 'read_text_file'
+    """
 
     # Check validity of file
     is_valid(filename)
 
+    if cache:
+        return _cached_(
+            filename,
+            scan_reader,
+            ScanFile.to_arrays,
+            ScanFile.from_arrays,
+            cache_dir,
+            max_bytes,
+            reader='scan',
+        )
+
     scan_file = scan_reader(filename)
 
     return scan_file
+
+
+
+#----------------------------------------------------------------
+# Ingestion of an export directory
+#----------------------------------------------------------------
+
+
+@dataclass
+class IngestedFile:
+    """
+    Result of parsing one file of a watched directory
+
+    filename: path of the file
+    mtime_ns: modification time of the file when it was parsed
+    data: DataFrame (*.txt) or ScanFile (*.SCAN), None if parsing failed
+    error: error message if parsing failed
+    """
+    filename: str
+    mtime_ns: int
+    data: pd.DataFrame|ScanFile = None
+    error: str = None
+
+
+def _ingest_file_(filename:str, **kwargs) -> tuple[pd.DataFrame|ScanFile, str]:
+    """
+    Parses a single file for 'IngestionService' with the reader matching its
+    extension, the error is returned (not raised)
+
+    - returns: data and None, or None and the error message
+    """
+    try:
+        if filename.lower().endswith('.scan'):
+            return read_scan_file(filename, **kwargs), None
+
+        return read_text_file(filename, **kwargs), None
+
+    except Exception as error:
+        return None, f"{type(error).__name__}: {error}"
+
+
+class IngestionService:
+    """
+    Watches a directory for new or changed exports and parses them on a
+    bounded pool of worker processes.
+
+    The directory is polled (no file system notifications needed, e.g. on a
+    network share). A file is parsed once its size and modification time
+    have not changed for 'settle' seconds, so files still being copied or
+    written are not read half-way. Every file is parsed once per change,
+    the results go onto 'queue' and into 'results'.
+
+    Usage:
+        service = IngestionService(directory)
+        task = asyncio.create_task(service.run())
+        while True:
+            ingested = await service.queue.get()
+    """
+
+    def __init__(
+            self,
+            directory:str,
+            patterns:list[str]=SUPPORTED_FILE_EXTENSIONS,
+            interval:float=1.0,
+            settle:float=2.0,
+            workers:int=None,
+            cache:bool=True,
+            cache_dir:str=None,
+            maxsize:int=0,
+        ) -> None:
+        """
+        directory: directory to watch (not recursive)
+        patterns: file name patterns to parse, case insensitive
+        interval: seconds between polls of the directory
+        settle: seconds a file must be unchanged before it is parsed
+        workers: number of worker processes, defaults to the number of CPUs
+        cache, cache_dir: parse cache, see 'read_text_file'
+        maxsize: bound of the queue, parsing waits while it is full (0: unbounded)
+        """
+        self.directory = directory
+        self.patterns = [pattern.lower() for pattern in patterns]
+        self.interval = interval
+        self.settle = settle
+        self.workers = workers or os.cpu_count() or 1
+        self.cache = cache
+        self.cache_dir = cache_dir
+
+        self.queue: asyncio.Queue[IngestedFile] = asyncio.Queue(maxsize)
+        self.results: dict[str, IngestedFile] = {}
+
+        # (size, mtime_ns) and time first seen of files not yet parsed
+        self._pending: dict[str, tuple[tuple[int, int], float]] = {}
+        # Modification time of files handed to the pool, not yet in 'results'
+        self._parsing: dict[str, int] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._stopped = asyncio.Event()
+
+        return None
+
+
+    def _matches_(self, name:str) -> bool:
+        name = name.lower()
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.patterns)
+
+
+    def scan(self) -> list[str]:
+        """
+        Polls the directory once.
+
+        - returns: files that have settled and are not parsed in their current version
+        """
+        now = time.monotonic()
+        settled = []
+        seen = set()
+
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file() or not self._matches_(entry.name):
+                    continue
+
+                filename = entry.path
+                stat = entry.stat()
+                signature = (stat.st_size, stat.st_mtime_ns)
+                seen.add(filename)
+
+                done = self.results.get(filename)
+                if done is not None and done.mtime_ns == stat.st_mtime_ns:
+                    continue
+
+                if self._parsing.get(filename) == stat.st_mtime_ns:
+                    continue
+
+                previous = self._pending.get(filename)
+                if previous is None or previous[0] != signature:
+                    self._pending[filename] = (signature, now)
+
+                elif now - previous[1] >= self.settle:
+                    del self._pending[filename]
+                    self._parsing[filename] = stat.st_mtime_ns
+                    settled.append(filename)
+
+        # Forgets files removed before they settled
+        for filename in set(self._pending) - seen:
+            del self._pending[filename]
+
+        return settled
+
+
+    async def _parse_(self, executor:ProcessPoolExecutor, semaphore:asyncio.Semaphore, filename:str) -> None:
+        mtime_ns = self._parsing[filename]
+
+        async with semaphore:
+            data, error = await asyncio.get_running_loop().run_in_executor(
+                executor,
+                partial(_ingest_file_, filename, cache=self.cache, cache_dir=self.cache_dir),
+            )
+
+        ingested = IngestedFile(filename, mtime_ns, data, error)
+        self.results[filename] = ingested
+        self._parsing.pop(filename, None)
+        await self.queue.put(ingested)
+
+        return None
+
+
+    async def run(self) -> None:
+        """
+        Polls the directory every 'interval' seconds until 'stop' is called
+        """
+        self._stopped.clear()
+        semaphore = asyncio.Semaphore(self.workers)
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            while not self._stopped.is_set():
+                for filename in self.scan():
+                    task = asyncio.create_task(self._parse_(executor, semaphore, filename))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+
+                try:
+                    await asyncio.wait_for(self._stopped.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            # Files already handed to the pool are finished
+            if self._tasks:
+                await asyncio.gather(*self._tasks)
+
+        return None
+
+
+    def stop(self) -> None:
+        """
+        Stops 'run' after the current poll
+        """
+        self._stopped.set()
+
+        return None
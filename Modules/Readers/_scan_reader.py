@@ -1,5 +1,18 @@
 from abc import ABC
+from typing import NamedTuple
 import re
+import warnings
+import numpy as np
+
+
+# Pattern of a single decimal number, optionally in scientific notation.
+#
+#    [+-]?   -> Matches an optional sign (+ or -) at the beginning of the number.
+#    \d*     -> Matches zero or more digits before the decimal point.
+#    \.?     -> Matches an optional decimal point.
+#    \d+     -> Matches one or more digits after the decimal point.
+#    (?:[eE][+-]?\d+)?   -> Matches the optional scientific notation part.
+_DECIMAL_PATTERN = re.compile(r'[+-]?\d*\.?\d+(?:[eE][+-]?\d+)?')
 
 
 class XY(ABC):
@@ -71,11 +84,35 @@ class Offsets(XY):
         super().__init__(x, y)
 
 
+class ScanPointError(NamedTuple):
+    """
+    Line of the 'Scan Points' block that could not be interpreted
+
+    line: line number within the block (0 is the line before the points)
+    text: content of the line
+    reason: why the line was rejected
+    """
+    line: int
+    text: str
+    reason: str
+
+
 class ScanPoints(XY):
-    def __init__(self, x:list[float], y:list[float], z:list[float]):
-        self.z = z
-        
-        super().__init__(x, y)
+    def __init__(self, xyz:np.ndarray, errors:list[ScanPointError]=None):
+        """
+        Data structure for 'Scan Points'
+
+        xyz: coordinates, dimension [3, N]
+        errors: lines of the block that could not be interpreted
+        """
+        self.xyz = np.asarray(xyz, dtype=np.float64).reshape(3, -1)
+        self.errors = [] if errors is None else errors
+        self.z = self.xyz[2]
+
+        super().__init__(self.xyz[0], self.xyz[1])
+
+    def __len__(self) -> int:
+        return self.xyz.shape[1]
 
 
 class TransmissionBaseline(XY):
@@ -102,6 +139,73 @@ class ScanFile:
         self.transmission_baseline = transmission_baseline
 
 
+    @classmethod
+    def from_arrays(cls, arrays:dict[str, np.ndarray]):
+        """
+        Creates the scan file from arrays written by 'to_arrays'
+        """
+        sd = arrays['substrate_dimensions']
+        a = arrays['alignment']
+        off = arrays['offsets']
+        tb = arrays['transmission_baseline']
+        flags = [_code_to_bool(code) for code in arrays['flags']]
+
+        errors = [
+            ScanPointError(int(line), str(text), str(reason))
+            for line, text, reason in zip(arrays['error_line'], arrays['error_text'], arrays['error_reason'])
+        ]
+
+        return cls(
+            substrate_dimensions=SubstrateDimensions(
+                x=float(sd[0]),
+                y=float(sd[1]),
+                shape=int(sd[2]),
+                diameter=float(sd[3]),
+                draw_wafer_notch=flags[0],
+            ),
+            alignment=Alignment(x=float(a[0]), y=float(a[1]), option=int(a[2])),
+            offsets=Offsets(
+                x=float(off[0]),
+                y=float(off[1]),
+                theta=float(off[2]),
+                use_initial_position=flags[1],
+            ),
+            scan_points=ScanPoints(np.array(arrays['xyz']), errors),
+            transmission_baseline=TransmissionBaseline(
+                x=float(tb[0]),
+                y=float(tb[1]),
+                use_point_for_transmission_baseline=flags[2],
+            ),
+        )
+
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """
+        Returns the scan file as a dictionary of arrays, e.g. for np.savez
+        """
+        sd = self.substrate_dimensions
+        a = self.alignment
+        off = self.offsets
+        tb = self.transmission_baseline
+        errors = self.scan_points.errors
+
+        return {
+            'substrate_dimensions': np.array([sd.x, sd.y, sd.shape, sd.diameter], dtype=float),
+            'alignment': np.array([a.x, a.y, a.option], dtype=float),
+            'offsets': np.array([off.x, off.y, off.theta], dtype=float),
+            'transmission_baseline': np.array([tb.x, tb.y], dtype=float),
+            'flags': np.array([
+                _bool_to_code(sd.draw_wafer_notch),
+                _bool_to_code(off.use_initial_position),
+                _bool_to_code(tb.use_point_for_transmission_baseline),
+            ], dtype=np.int8),
+            'xyz': np.asarray(self.scan_points.xyz, dtype=np.float64),
+            'error_line': np.array([e.line for e in errors], dtype=np.int64),
+            'error_text': np.array([e.text for e in errors], dtype=str),
+            'error_reason': np.array([e.reason for e in errors], dtype=str),
+        }
+
+
 def _scanfile_to_dict(file:list[str]) -> dict:
     """
     Reads file into dictionary with properties as keys 
@@ -150,6 +254,63 @@ def _text_to_bool(text:str) -> bool:
         return None
     
 
+def _bool_to_code(value:bool) -> int:
+    """
+    Converts True, False or None (not interpreted) to 1, 0 or -1 respectively
+    """
+    return -1 if value is None else int(value)
+
+
+def _code_to_bool(code:int) -> bool:
+    """
+    Converts 1, 0 or -1 back to True, False or None respectively
+    """
+    return None if code < 0 else bool(code)
+
+
+def _parse_scan_points_(lines:list[str]) -> tuple[np.ndarray, list[ScanPointError]]:
+    """
+    Parses the lines of the 'Scan Points' block into a float64 array,
+    dimension [3, N].
+
+    The whole block is converted by NumPy in one call. Only if that fails
+    the lines are parsed one by one, to keep the valid points and report
+    every malformed line.
+
+    - returns: xyz coordinates and the lines that could not be interpreted
+    """
+    # Blank lines carry no points (e.g. a trailing newline), the line numbers
+    # within the block are kept for the error report
+    numbered = [(i, line) for i, line in enumerate(lines, start=1) if line.strip()]
+    lines = [line for _, line in numbered]
+
+    if len(lines) == 0:
+        return np.zeros((3, 0)), []
+
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            xyz = np.loadtxt(lines, dtype=np.float64, ndmin=2)
+
+        if xyz.shape[1] == 3:
+            return xyz.T.copy(), []
+
+    except (ValueError, UserWarning):
+        pass
+
+    # Line by line, collecting the malformed lines instead of failing
+    points, errors = [], []
+    for i, line in numbered:
+        decimals = _DECIMAL_PATTERN.findall(line.strip())
+
+        if len(decimals) == 3:
+            points.append([float(d) for d in decimals])
+        else:
+            errors.append(ScanPointError(i, line.rstrip('\n'), f"expected 3 values, found {len(decimals)}"))
+
+    return np.array(points, dtype=np.float64).reshape(-1, 3).T.copy(), errors
+
+
 def scan_reader(filename:str) -> ScanFile:
 
     # Read file into memory
@@ -189,46 +350,9 @@ def scan_reader(filename:str) -> ScanFile:
         use_initial_position=_text_to_bool(off[3]),
     )
 
-    # Extract x,y,z coordinates
-    xyz = data["Scan Points"]
-    """
-    Explanation of the regex pattern:
-
-        [+-]?   -> Matches an optional sign (+ or -) at the beginning of the number.
-        \d*     -> Matches zero or more digits before the decimal point.
-        \.?     -> Matches an optional decimal point.
-        \d+     -> Matches one or more digits after the decimal point.
-        (?:[eE][+-]?\d+)?   -> Matches the optional scientific notation part:
-            (?: ... )   -> This is a non-capturing group. It groups part of the regex without 
-                            creating a backreference (i.e., it doesn't store the match for later use).
-            [eE]        -> Matches the letter e or E for scientific notation.
-            [+-]?       -> Matches an optional sign (+ or -) for the exponent.
-            \d+         -> Matches one or more digits for the exponent.
-    """
-
-    x_list = []
-    y_list = []
-    z_list = []
-    for line in xyz[1:]:
-
-        # Regular expression pattern
-        pattern = r'[+-]?\d*\.?\d+(?:[eE][+-]?\d+)?'
-        decimals = re.findall(pattern, line.strip())
-
-        if len(decimals) == 3:
-            x, y, z = decimals
-            x_list.append(float(x))
-            y_list.append(float(y))
-            z_list.append(float(z))
-        else:
-            print(f'Error in interpreting: {line}')
-
-
-    scan_points = ScanPoints(
-        x=x_list, 
-        y=y_list, 
-        z=z_list,
-    )
+    # Extract x,y,z coordinates, the first line of the block precedes the points
+    xyz, errors = _parse_scan_points_(data["Scan Points"][1:])
+    scan_points = ScanPoints(xyz, errors)
 
 
     # Extract transmission baseline
@@ -12,16 +12,69 @@ parent_dir = os.path.dirname(current_dir)
 # Add the parent directory to sys.path
 sys.path.append(parent_dir)
 
-from Utilities.Transform import rotate, translate
+from Utilities.Transform import Affine
+
+
+def segment_distance(xy:np.ndarray, start:np.ndarray, end:np.ndarray) -> np.ndarray:
+    """
+    Returns the distance from the points to the line segment 'start' -> 'end'
+
+    - xy: np.ndarray dimension [2, N]
+    - start, end: np.ndarray dimension [2]
+    - returns: np.ndarray dimension [N]
+    """
+    start = np.asarray(start, dtype=float)
+    direction = np.asarray(end, dtype=float) - start
+
+    dx = xy[0] - start[0]
+    dy = xy[1] - start[1]
+
+    length2 = direction @ direction
+    if length2 == 0:
+        return np.hypot(dx, dy)
+
+    t = np.clip((dx * direction[0] + dy * direction[1]) / length2, 0, 1)
+
+    return np.hypot(dx - t * direction[0], dy - t * direction[1])
+
+
+
+def arc_points(radius:float, sweep:float, tolerance:float, minimum:int=3) -> int:
+    """
+    Returns the number of points needed to sample an arc, such that the
+    chord error (sagitta) of every segment stays within 'tolerance'
+
+    - radius: radius of the arc
+    - sweep: sweep angle of the arc in degrees
+    - tolerance: maximum distance between chord and arc
+    - minimum: minimum number of points
+    """
+    if tolerance <= 0:
+        raise ValueError(f"Tolerance must be positive, was given: {tolerance}")
+
+    if tolerance >= radius:
+        return minimum
+
+    step = 2 * np.arccos(1 - tolerance / radius)
+    n_segments = int(np.ceil(np.deg2rad(abs(sweep)) / step))
+
+    return max(n_segments + 1, minimum)
+
 
 
 class Shape(ABC):
     """
     Base class for shapes
     """
+    # Number of outline points if neither 'n' nor 'tolerance' is given
+    N_POINTS: int = 24
+
     def __init__(self) -> None:
         self.center: np.ndarray = np.array([0, 0]).T
         self.angle: float = 0
+
+        self._outline_key: tuple = None
+        self._outline_cache: dict[int, np.ndarray] = {}
         
         return None
     
@@ -41,21 +94,116 @@ class Shape(ABC):
 
 
     @abstractmethod
-    def get_x(self) -> list[float]:
+    def _dimensions_(self) -> tuple:
+        """
+        Returns the dimensions defining the shape, used for invalidating
+        the outline cache
+        """
+        pass
+
+
+    @abstractmethod
+    def _local_outline_(self, n:int) -> np.ndarray:
+        """
+        Returns 'n' outline points in the shape's own frame, dimension [2, N]
+        """
+        pass
+
+
+    @abstractmethod
+    def _local_contains_(self, xy:np.ndarray) -> np.ndarray:
         """
-        Returns a list of x coordinates of the shape
+        Returns a boolean mask of the points (in the shape's own frame)
+        inside the shape, dimension [N]
         """
         pass
 
 
     @abstractmethod
-    def get_y(self) -> list[float]:
+    def _local_distance_(self, xy:np.ndarray) -> np.ndarray:
         """
-        Returns a list of y coordinates of the shape
+        Returns the signed distance of the points (in the shape's own frame)
+        to the boundary of the shape, dimension [N]
         """
         pass
 
 
+    def _n_points_(self, tolerance:float) -> int:
+        """
+        Returns the number of outline points needed for a chord error
+        within 'tolerance'
+        """
+        return self.N_POINTS
+
+
+    def contains(self, xy:np.ndarray) -> np.ndarray:
+        """
+        Returns a boolean mask of the points inside the shape (boundary included).
+        Points are mapped into the shape's own frame in one pass, so both
+        'center' and 'angle' are honored.
+
+        - xy: np.ndarray dimension [2, N] (or [2] for a single point)
+        - returns: np.ndarray of bool, dimension [N] (or a scalar)
+        """
+        local = self.transform().inverse().apply(xy)
+
+        return self._local_contains_(local)
+
+
+    def signed_distance(self, xy:np.ndarray) -> np.ndarray:
+        """
+        Returns the signed distance from the points to the boundary of the
+        shape, negative inside and positive outside.
+
+        - xy: np.ndarray dimension [2, N] (or [2] for a single point)
+        - returns: np.ndarray dimension [N] (or a scalar)
+        """
+        local = self.transform().inverse().apply(xy)
+
+        return self._local_distance_(local)
+
+
+    def outline(self, n:int=None, tolerance:float=None) -> np.ndarray:
+        """
+        Returns the outline of the shape, dimension [2, N].
+
+        The result is cached (read-only) and only recomputed when center,
+        angle or dimensions of the shape change.
+
+        - n: number of points (default: N_POINTS)
+        - tolerance: maximum chord error, sets 'n' if 'n' is not given
+        """
+        key = (float(self.center[0]), float(self.center[1]), float(self.angle)) + self._dimensions_()
+        if key != self._outline_key:
+            self._outline_key = key
+            self._outline_cache.clear()
+
+        if n is None:
+            n = self.N_POINTS if tolerance is None else self._n_points_(tolerance)
+
+        if n not in self._outline_cache:
+            xy = self.transform().apply(self._local_outline_(n))
+            xy.flags.writeable = False
+
+            self._outline_cache[n] = xy
+
+        return self._outline_cache[n]
+
+
+    def get_x(self) -> np.ndarray:
+        """
+        Returns the x coordinates of the outline of the shape
+        """
+        return self.outline()[0]
+
+
+    def get_y(self) -> np.ndarray:
+        """
+        Returns the y coordinates of the outline of the shape
+        """
+        return self.outline()[1]
+
+
     def _plot_as_scatter_(self, axes, **kwargs:dict) -> None:
         """
         Plot shape object as a scatter or line plot
@@ -81,12 +229,20 @@ class Shape(ABC):
         return None
     
 
+    def transform(self) -> Affine:
+        """
+        Returns the transformation from the shape's own frame to the
+        plotting frame, i.e. rotation by 'angle' followed by translation
+        to 'center'
+        """
+        return Affine.rotation(self.angle).translate(*self.center)
+
+
     def translate(self, x:float, y:float):
         """
         Translates the shape with offset (x,y)
         """
-        offset = np.array([x, y]).T
-        self.center = translate(self.center, offset)
+        self.center = Affine.translation(x, y).apply(self.center)
 
         return self
     
@@ -116,16 +272,27 @@ class Circle(Shape):
     def area(self) -> float:
         return np.pi * self.radius**2
 
-    def get_x(self) -> list[float]:
-        angle = np.linspace(0, 2*np.pi, int(360/15), endpoint=True)
 
-        return [np.cos(a) * self.radius + self.center[0] for a in angle]
-    
-    
-    def get_y(self) -> list[float]:
-        angle = np.linspace(0, 2*np.pi, int(360/15), endpoint=True)
+    def _dimensions_(self) -> tuple:
+        return (self.radius,)
+
+
+    def _n_points_(self, tolerance:float) -> int:
+        return arc_points(self.radius, 360, tolerance, minimum=4)
+
+
+    def _local_outline_(self, n:int) -> np.ndarray:
+        angle = np.linspace(0, 2*np.pi, n, endpoint=True)
+
+        return self.radius * np.array([np.cos(angle), np.sin(angle)])
+
+
+    def _local_contains_(self, xy:np.ndarray) -> np.ndarray:
+        return xy[0]**2 + xy[1]**2 <= self.radius**2
+
 
-        return [np.sin(a) * self.radius + self.center[1] for a in angle]
+    def _local_distance_(self, xy:np.ndarray) -> np.ndarray:
+        return np.hypot(xy[0], xy[1]) - self.radius
     
 
     def get_patch(self, **kwargs) -> patches.Patch:
@@ -162,33 +329,67 @@ class Ellipse(Shape):
         )
     
     
-    def _xy_(self):
-        angle = np.linspace(0, 2*np.pi, int(360/15), endpoint=True)
+    def _dimensions_(self) -> tuple:
+        return (self.width, self.height)
 
-        x = [0.5 * self.width * np.cos(a) for a in angle]
-        y = [0.5 * self.height * np.sin(a) for a in angle]
-        
-        return x, y
-    
 
-    def area(self) -> float:
-        return np.pi * self.width * self.height
-    
+    def _n_points_(self, tolerance:float) -> int:
+        # The outline is an affine image of a circle with the larger
+        # semi-axis as radius, which bounds the chord error
+        return arc_points(0.5 * max(self.width, self.height), 360, tolerance, minimum=4)
 
-    def get_x(self) -> list[float]:
-        
-        x_coor, y_coor = self._xy_()
-        rad = np.deg2rad(self.angle)
 
-        return [x * np.cos(rad) - y * np.sin(rad) + self.center[0] for x, y in zip(x_coor, y_coor)]
-        
+    def _local_outline_(self, n:int) -> np.ndarray:
+        angle = np.linspace(0, 2*np.pi, n, endpoint=True)
 
-    def get_y(self) -> list[float]:
-        
-        x_coor, y_coor = self._xy_()
-        rad = np.deg2rad(self.angle)
+        return np.array([
+            0.5 * self.width * np.cos(angle),
+            0.5 * self.height * np.sin(angle),
+        ])
+
+
+    def _local_contains_(self, xy:np.ndarray) -> np.ndarray:
+        u = xy[0] / (0.5 * self.width)
+        v = xy[1] / (0.5 * self.height)
+
+        return u**2 + v**2 <= 1
+
+
+    def _local_distance_(self, xy:np.ndarray) -> np.ndarray:
+        """
+        NOTE: The distance to an ellipse has no closed form, the closest
+        point is found by a few fixed-point iterations on the evolute,
+        which converge to well below the outline resolution.
+        """
+        a, b = 0.5 * self.width, 0.5 * self.height
+        px, py = np.abs(xy[0]), np.abs(xy[1])
+
+        tx = np.full(np.shape(px), np.sqrt(0.5))
+        ty = np.full(np.shape(py), np.sqrt(0.5))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for _ in range(4):
+                ex = (a**2 - b**2) * tx**3 / a
+                ey = (b**2 - a**2) * ty**3 / b
 
-        return [y * np.cos(rad) + x * np.sin(rad) + self.center[1] for x, y in zip(x_coor, y_coor)]
+                r = np.hypot(a * tx - ex, b * ty - ey)
+                q = np.hypot(px - ex, py - ey)
+                q = np.where(q > 0, q, 1)
+
+                tx = np.clip(((px - ex) * r / q + ex) / a, 0, 1)
+                ty = np.clip(((py - ey) * r / q + ey) / b, 0, 1)
+
+                t = np.hypot(tx, ty)
+                tx, ty = tx / t, ty / t
+
+        distance = np.hypot(px - a * tx, py - b * ty)
+
+        return np.where(self._local_contains_(xy), -distance, distance)
+    
+
+    def area(self) -> float:
+        # 'width' and 'height' are the full axes, i.e. twice the semi-axes
+        return np.pi * self.width * self.height / 4
 
 
 
@@ -206,54 +407,64 @@ class Rectangle(Shape):
         super().__init__()
 
     
-    def _xy_(self):
-        x = [0, self.width, self.width, 0, 0]
-        y = [0, 0, self.height, self.height, 0]
+    def _dimensions_(self) -> tuple:
+        return (self.width, self.height, self.centered)
+
 
-        coor = np.array([x, y])
+    def _local_outline_(self, n:int) -> np.ndarray:
+        """
+        The outline of a rectangle is always its 5 corner points (closed),
+        regardless of 'n'
+        """
+        x = np.array([0, self.width, self.width, 0, 0], dtype=float)
+        y = np.array([0, 0, self.height, self.height, 0], dtype=float)
 
         if self.centered:
-            coor = translate(
-                coor, 
-                np.array([
-                    -.5*self.width, 
-                    -.5*self.height
-                ])
-            )
+            x -= .5 * self.width
+            y -= .5 * self.height
 
-        coor = rotate(coor, self.angle)
-        coor = translate(coor, self.center)
+        return np.array([x, y])
 
-        return coor
-    
 
-    def area(self) -> float:
-        return self.width * self.height
-    
-    def get_x(self) -> list[float]:
-        coor = self._xy_()
+    def _local_contains_(self, xy:np.ndarray) -> np.ndarray:
+        x, y = xy[0], xy[1]
 
-        return coor[0, :]
-    
+        if self.centered:
+            x = x + .5 * self.width
+            y = y + .5 * self.height
+
+        return (x >= 0) & (x <= self.width) & (y >= 0) & (y <= self.height)
+
+
+    def _local_distance_(self, xy:np.ndarray) -> np.ndarray:
+        x, y = xy[0], xy[1]
+
+        if not self.centered:
+            x = x - .5 * self.width
+            y = y - .5 * self.height
+
+        qx = np.abs(x) - .5 * self.width
+        qy = np.abs(y) - .5 * self.height
 
-    def get_y(self) -> list[float]:
-        coor = self._xy_()
+        outside = np.hypot(np.maximum(qx, 0), np.maximum(qy, 0))
+        inside = np.minimum(np.maximum(qx, qy), 0)
 
-        return coor[1, :]
+        return outside + inside
+    
+
+    def area(self) -> float:
+        return self.width * self.height
     
     
     def get_patch(self, **kwargs) -> patches.Patch:
 
         if self.centered:
-            center = rotate(
+            center = self.transform().apply(
                 np.array([
                     -.5 * self.width,
                     -.5 * self.height
-                ]),
-                self.angle
+                ])
             )
-
-            center = translate(center, self.center)
         
         else:
             center = self.center
@@ -270,6 +481,9 @@ class Rectangle(Shape):
 
 
 class Sector(Shape):
+    # Number of points along the arc if neither 'n' nor 'tolerance' is given
+    N_POINTS: int = 9
+
     def __init__(self, radius:float, sweep_angle:float):
         """
         Sector implementation of 'Shape'.
@@ -299,32 +513,271 @@ class Sector(Shape):
         )
     
 
-    def _get_angle_(self, n_points) -> list[float]:
-        a_start = np.deg2rad(self.angle)
-        a_stop = np.deg2rad(self.angle + self.sweep_angle)
+    def _dimensions_(self) -> tuple:
+        return (self.radius, self.sweep_angle)
 
-        return np.linspace(a_start, a_stop, n_points)
-    
 
-    def get_x(self) -> list[float]:
-        x = [self.center[0]]        
-        angle = self._get_angle_(9)
-        
-        x.extend([np.cos(a) * self.radius + self.center[0] for a in angle])
-        
-        return x + [self.center[0]]
-        
-    
-    def get_y(self) -> list[float]:
-        y = [self.center[1]]
-        angle = self._get_angle_(9)
-        
-        y.extend([np.sin(a) * self.radius + self.center[1] for a in angle])
+    def _n_points_(self, tolerance:float) -> int:
+        return arc_points(self.radius, self.sweep_angle, tolerance, minimum=2)
+
+
+    def _local_outline_(self, n:int) -> np.ndarray:
+        """
+        Center, 'n' points along the arc and back to the center
+        """
+        angle = np.linspace(0, np.deg2rad(self.sweep_angle), n)
+
+        xy = np.zeros((2, n + 2))
+        xy[0, 1:-1] = self.radius * np.cos(angle)
+        xy[1, 1:-1] = self.radius * np.sin(angle)
+
+        return xy
+
+
+    def _local_contains_(self, xy:np.ndarray) -> np.ndarray:
+        in_radius = xy[0]**2 + xy[1]**2 <= self.radius**2
+
+        if self.sweep_angle >= 360:
+            return in_radius
+
+        phi = np.rad2deg(np.arctan2(xy[1], xy[0])) % 360
+
+        return in_radius & (phi <= self.sweep_angle)
 
-        return y + [self.center[1]]
+
+    def _local_distance_(self, xy:np.ndarray) -> np.ndarray:
+        rho = np.hypot(xy[0], xy[1])
+        end = np.deg2rad(self.sweep_angle)
+        arc_start = np.array([self.radius, 0])
+        arc_end = self.radius * np.array([np.cos(end), np.sin(end)])
+
+        # Distance to the arc, which is either radial or to its end points
+        if self.sweep_angle >= 360:
+            return rho - self.radius
+
+        phi = np.rad2deg(np.arctan2(xy[1], xy[0])) % 360
+        distance = np.where(
+            phi <= self.sweep_angle,
+            np.abs(rho - self.radius),
+            np.minimum(
+                np.hypot(xy[0] - arc_start[0], xy[1] - arc_start[1]),
+                np.hypot(xy[0] - arc_end[0], xy[1] - arc_end[1]),
+            ),
+        )
+
+        # Distance to the two straight edges
+        origin = np.zeros(2)
+        distance = np.minimum(distance, segment_distance(xy, origin, arc_start))
+        distance = np.minimum(distance, segment_distance(xy, origin, arc_end))
+
+        return np.where(self._local_contains_(xy), -distance, distance)
     
 
 
+class ShapeArray(ABC):
+    """
+    Base class for many shapes of the same kind.
+
+    The shapes are stored as contiguous arrays (struct-of-arrays) instead
+    of individual 'Shape' objects, and all methods work on every shape at once.
+    """
+    def __init__(self, centers:np.ndarray, angles:np.ndarray=None, dtype=np.float64) -> None:
+        """
+        - centers: np.ndarray dimension [2, N] containing the centers
+        - angles: rotation of every shape in degrees, dimension [N] (default: 0)
+        - dtype: floating point type of the arrays, e.g. np.float32
+        """
+        self.centers: np.ndarray = np.array(centers, dtype=dtype, ndmin=2).reshape(2, -1)
+
+        if angles is None:
+            angles = 0
+        self.angles: np.ndarray = self._per_shape_(angles)
+
+        return None
+
+
+    def __len__(self) -> int:
+        return self.centers.shape[1]
+
+
+    def _per_shape_(self, values:float|np.ndarray) -> np.ndarray:
+        """
+        Returns 'values' as a contiguous array with one value per shape
+        """
+        values = np.broadcast_to(np.asarray(values, dtype=self.centers.dtype), (len(self),))
+
+        return values.copy()
+
+
+    @abstractmethod
+    def __getitem__(self, i:int) -> Shape:
+        """
+        Returns shape 'i' as an individual 'Shape' object
+        """
+        pass
+
+
+    @classmethod
+    @abstractmethod
+    def from_shapes(cls, shapes:list[Shape], dtype=np.float64):
+        """
+        Creates the array from a list of individual 'Shape' objects
+        """
+        pass
+
+
+    @abstractmethod
+    def area(self) -> np.ndarray:
+        """
+        Returns the area of every shape, dimension [N]
+        """
+        pass
+
+
+    @abstractmethod
+    def _local_outline_(self, n:int) -> np.ndarray:
+        """
+        Returns 'n' outline points of every shape in its own frame, dimension [2, N, n]
+        """
+        pass
+
+
+    @abstractmethod
+    def _local_contains_(self, xy:np.ndarray) -> np.ndarray:
+        """
+        Returns a boolean mask of the points (in the frame of every shape,
+        dimension [2, N, M]) inside the shapes, dimension [N, M]
+        """
+        pass
+
+
+    def to_shapes(self) -> list[Shape]:
+        """
+        Returns the shapes as a list of individual 'Shape' objects
+        """
+        return [self[i] for i in range(len(self))]
+
+
+    def _rotation_(self) -> tuple[np.ndarray, np.ndarray]:
+        rad = np.deg2rad(self.angles)
+
+        return np.cos(rad)[:, np.newaxis], np.sin(rad)[:, np.newaxis]
+
+
+    def outline(self, n:int=Shape.N_POINTS) -> np.ndarray:
+        """
+        Returns the outline of every shape, dimension [2, N, n]
+
+        - n: number of points per shape
+        """
+        x, y = self._local_outline_(n)
+        cos, sin = self._rotation_()
+
+        return np.array([
+            x * cos - y * sin + self.centers[0][:, np.newaxis],
+            x * sin + y * cos + self.centers[1][:, np.newaxis],
+        ])
+
+
+    def contains(self, xy:np.ndarray) -> np.ndarray:
+        """
+        Returns a boolean mask of which shapes contain which points
+        (boundary included), honoring the center and angle of every shape
+
+        - xy: np.ndarray dimension [2, M]
+        - returns: np.ndarray of bool, dimension [N, M]
+        """
+        xy = np.asarray(xy).reshape(2, -1)
+        cos, sin = self._rotation_()
+
+        dx = xy[0] - self.centers[0][:, np.newaxis]
+        dy = xy[1] - self.centers[1][:, np.newaxis]
+
+        local = np.array([
+            dx * cos + dy * sin,
+            dy * cos - dx * sin,
+        ])
+
+        return self._local_contains_(local)
+
+
+    def translate(self, x:float, y:float):
+        """
+        Translates all shapes with offset (x,y)
+        """
+        self.centers += np.array([[x], [y]], dtype=self.centers.dtype)
+
+        return self
+
+
+    def rotate(self, angle:float):
+        """
+        Rotates all shapes 'angle' degrees, as 'Shape.rotate'
+        """
+        self.angles += angle
+
+        return self
+
+
+
+class EllipseArray(ShapeArray):
+    def __init__(self, centers:np.ndarray, widths:float|np.ndarray, heights:float|np.ndarray, angles:np.ndarray=None, dtype=np.float64) -> None:
+        """
+        Array implementation of 'Ellipse'.
+
+        - centers: np.ndarray dimension [2, N] containing the centers
+        - widths: length along x axis, one value or dimension [N]
+        - heights: length along y axis, one value or dimension [N]
+        - angles: rotation of every ellipse in degrees, dimension [N] (default: 0)
+        """
+        super().__init__(centers, angles, dtype)
+
+        self.widths: np.ndarray = self._per_shape_(widths)
+        self.heights: np.ndarray = self._per_shape_(heights)
+
+        return None
+
+
+    def __getitem__(self, i:int) -> Ellipse:
+        ellipse = Ellipse(width=float(self.widths[i]), height=float(self.heights[i]))
+        ellipse.angle = float(self.angles[i])
+        ellipse.center = self.centers[:, i].astype(float)
+
+        return ellipse
+
+
+    @classmethod
+    def from_shapes(cls, shapes:list[Ellipse], dtype=np.float64):
+        return cls(
+            centers=np.array([shape.center for shape in shapes], dtype=dtype).T.reshape(2, -1),
+            widths=[shape.width for shape in shapes],
+            heights=[shape.height for shape in shapes],
+            angles=[shape.angle for shape in shapes],
+            dtype=dtype,
+        )
+
+
+    def area(self) -> np.ndarray:
+        return np.pi * self.widths * self.heights / 4
+
+
+    def _local_outline_(self, n:int) -> np.ndarray:
+        angle = np.linspace(0, 2*np.pi, n, endpoint=True)
+
+        return np.array([
+            0.5 * self.widths[:, np.newaxis] * np.cos(angle),
+            0.5 * self.heights[:, np.newaxis] * np.sin(angle),
+        ])
+
+
+    def _local_contains_(self, xy:np.ndarray) -> np.ndarray:
+        u = xy[0] / (0.5 * self.widths[:, np.newaxis])
+        v = xy[1] / (0.5 * self.heights[:, np.newaxis])
+
+        return u**2 + v**2 <= 1
+
+
+
 if __name__ == '__main__':
     import matplotlib.pyplot as plt
 
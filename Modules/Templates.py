@@ -20,3 +20,19 @@ STAGE = {
     'linewidth': 0.5,
     'zorder': 1,    
 }
+
+
+def collection_style(style:dict) -> dict:
+    """
+    Converts a patch style (as the templates above) to keyword arguments
+    accepted by a matplotlib collection.
+
+    Collections have no 'fill' property, 'fill': False is translated to
+    an empty face color instead.
+    """
+    style = dict(style)
+
+    if not style.pop('fill', True):
+        style['facecolor'] = 'none'
+
+    return style
@@ -0,0 +1,272 @@
+import hashlib
+import os
+import zipfile
+
+import numpy as np
+
+
+# Default directory for cache files, can be overridden with the
+# environment variable 'CALLIPSO_CACHE_DIR'
+DEFAULT_CACHE_DIR = os.getenv(
+    'CALLIPSO_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'callipso'),
+)
+
+# Default upper bound of the total size of a cache directory, in bytes
+DEFAULT_MAX_BYTES = 2**30
+
+
+def content_hash(filename:str, chunksize:int=2**20) -> str:
+    """
+    Returns the BLAKE2 hash of the content of 'filename'
+    """
+    digest = hashlib.blake2b(digest_size=16)
+
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunksize), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def file_metadata(filename:str, with_hash:bool=True) -> dict[str, np.ndarray]:
+    """
+    Returns path, size, modification time and (optionally) content hash of
+    'filename' as arrays, ready to be stored next to cached data
+    """
+    stat = os.stat(filename)
+
+    metadata = {
+        '__path__': np.array(os.path.abspath(filename)),
+        '__size__': np.array(stat.st_size, dtype=np.int64),
+        '__mtime_ns__': np.array(stat.st_mtime_ns, dtype=np.int64),
+    }
+
+    if with_hash:
+        metadata['__hash__'] = np.array(content_hash(filename))
+
+    return metadata
+
+
+def cache_filename(filename:str, cache_dir:str=None, suffix:str='.npz', **key) -> str:
+    """
+    Returns the cache file for 'filename', one per absolute path and
+    combination of 'key' parameters (e.g. reader options)
+    """
+    if cache_dir is None:
+        cache_dir = DEFAULT_CACHE_DIR
+
+    name = repr((os.path.abspath(filename), sorted(key.items())))
+    digest = hashlib.blake2b(name.encode(), digest_size=16).hexdigest()
+
+    return os.path.join(cache_dir, digest + suffix)
+
+
+def is_fresh(filename:str, metadata:dict[str, np.ndarray]) -> bool:
+    """
+    Checks whether cached 'metadata' still describes 'filename'.
+
+    Size and modification time are compared first, the content hash is
+    only computed when they differ (e.g. after a copy or touch).
+    """
+    if not os.path.exists(filename):
+        return False
+
+    stat = os.stat(filename)
+    if int(metadata['__size__']) != stat.st_size:
+        return False
+
+    if int(metadata['__mtime_ns__']) == stat.st_mtime_ns:
+        return True
+
+    return str(metadata['__hash__']) == content_hash(filename)
+
+
+def save_npz(path:str, arrays:dict[str, np.ndarray], max_bytes:int=None) -> None:
+    """
+    Writes 'arrays' to an uncompressed *.npz file (so it can be memory-mapped).
+    The file is written next to 'path' and moved in place, so readers never
+    see a partially written cache.
+
+    With 'max_bytes' the least recently used files of the cache directory
+    are removed afterwards, see 'evict'.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as f:
+        np.savez(f, **arrays)
+
+    os.replace(temporary, path)
+
+    if max_bytes is not None:
+        evict(os.path.dirname(os.path.abspath(path)), max_bytes, keep=path)
+
+    return None
+
+
+def _cache_files_(cache_dir:str=None) -> list[os.DirEntry]:
+    """
+    Returns the *.npz files of 'cache_dir', least recently used first
+    """
+    if cache_dir is None:
+        cache_dir = DEFAULT_CACHE_DIR
+
+    if not os.path.isdir(cache_dir):
+        return []
+
+    with os.scandir(cache_dir) as entries:
+        files = [entry for entry in entries if entry.is_file() and entry.name.endswith('.npz')]
+
+    return sorted(files, key=lambda entry: entry.stat().st_mtime_ns)
+
+
+def evict(cache_dir:str=None, max_bytes:int=DEFAULT_MAX_BYTES, keep:str=None) -> list[str]:
+    """
+    Removes the least recently used cache files until the total size of
+    'cache_dir' is at most 'max_bytes'. A cache hit ('load_fresh') marks a
+    file as used by updating its modification time.
+
+    - keep: cache file never removed, e.g. the one just written
+    - returns: removed cache files
+    """
+    files = _cache_files_(cache_dir)
+    total = sum(entry.stat().st_size for entry in files)
+
+    removed = []
+    for entry in files:
+        if total <= max_bytes:
+            break
+
+        if keep is not None and os.path.abspath(entry.path) == os.path.abspath(keep):
+            continue
+
+        try:
+            size = entry.stat().st_size
+            os.remove(entry.path)
+        except OSError:
+            # In use (e.g. memory-mapped on Windows) or removed by another process
+            continue
+
+        total -= size
+        removed.append(entry.path)
+
+    return removed
+
+
+def invalidate(filename:str=None, cache_dir:str=None) -> list[str]:
+    """
+    Removes the cache files of 'filename', for all reader options it was
+    cached with, or every cache file of 'cache_dir' if no filename is given
+
+    - returns: removed cache files
+    """
+    source = None if filename is None else os.path.abspath(filename)
+
+    removed = []
+    for entry in _cache_files_(cache_dir):
+        if source is not None:
+            try:
+                with np.load(entry.path, allow_pickle=False) as npz:
+                    if str(npz['__path__']) != source:
+                        continue
+            except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+                continue
+
+        try:
+            os.remove(entry.path)
+        except OSError:
+            continue
+
+        removed.append(entry.path)
+
+    return removed
+
+
+def _member_offset_(f, info:zipfile.ZipInfo) -> int:
+    """
+    Returns the offset of the data of a zip member, after its local header
+    """
+    f.seek(info.header_offset + 26)
+    name_length = int.from_bytes(f.read(2), 'little')
+    extra_length = int.from_bytes(f.read(2), 'little')
+
+    return info.header_offset + 30 + name_length + extra_length
+
+
+def load_npz(path:str, mmap:bool=True) -> dict[str, np.ndarray]:
+    """
+    Reads all arrays of an *.npz file.
+
+    With 'mmap' the arrays of uncompressed files are memory-mapped read-only
+    instead of read, so only the parts actually used are loaded from disk.
+    """
+    arrays = {}
+
+    with np.load(path, allow_pickle=False) as npz, open(path, 'rb') as f:
+        members = {info.filename: info for info in npz.zip.infolist()}
+
+        for key in npz.files:
+            info = members[key + '.npy']
+
+            if mmap and info.compress_type == zipfile.ZIP_STORED:
+                f.seek(_member_offset_(f, info))
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+                if len(shape) > 0 and np.prod(shape) > 0 and not dtype.hasobject:
+                    arrays[key] = np.memmap(
+                        path,
+                        dtype=dtype,
+                        mode='r',
+                        offset=f.tell(),
+                        shape=shape,
+                        order='F' if fortran_order else 'C',
+                    )
+                    continue
+
+            arrays[key] = npz[key]
+
+    return arrays
+
+
+def load_fresh(path:str, filename:str, mmap:bool=True) -> dict[str, np.ndarray]:
+    """
+    Reads the cache file 'path' if it still describes 'filename'
+
+    When the content is unchanged but the modification time is not (e.g.
+    after a copy or touch), the stored metadata is updated, so the content
+    hash is not computed again on the next call.
+
+    A cache file that can not be read (truncated, corrupt, or written in
+    an unsupported layout) is treated as missing, the caller rebuilds it.
+
+    - returns: dictionary of arrays, or None if missing, unreadable or outdated
+    """
+    if not os.path.exists(path):
+        return None
+
+    try:
+        arrays = load_npz(path, mmap=mmap)
+
+        if not is_fresh(filename, arrays):
+            return None
+
+    except (ValueError, KeyError, OSError, zipfile.BadZipFile):
+        return None
+
+    # Marks the cache file as recently used, for 'evict'
+    os.utime(path)
+
+    if int(arrays['__mtime_ns__']) != os.stat(filename).st_mtime_ns:
+        # Arrays are read into memory first, a memory-mapped file can not
+        # be replaced on all platforms
+        arrays = {key: np.array(value) for key, value in arrays.items()}
+        arrays.update(file_metadata(filename))
+
+        save_npz(path, arrays)
+
+    return arrays
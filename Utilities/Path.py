@@ -0,0 +1,163 @@
+import numpy as np
+
+from Utilities.Transform import check_dim
+
+
+
+class StageModel:
+    """
+    Travel time model of the mapping stage.
+
+    An x/y stage moves both axes at once, so a move takes as long as its
+    longest axis. A theta stage (radius and rotation around (0, 0)) moves
+    its linear and rotation axis at once, the rotation taking the shorter
+    way around.
+    """
+
+    def __init__(self, speed:float=1.0, rotation_speed:float=None, settle:float=0.0) -> None:
+        """
+        - speed: linear axis speed, distance units per second
+        - rotation_speed: rotation axis speed in degrees per second, makes the
+            stage a theta stage (default: x/y stage)
+        - settle: time per move spent on settling, in seconds
+        """
+        if speed <= 0:
+            raise ValueError(f"Speed must be positive, was given: {speed}")
+
+        self.speed = speed
+        self.rotation_speed = rotation_speed
+        self.settle = settle
+
+        return None
+
+
+    def move_time(self, xy_from:np.ndarray, xy_to:np.ndarray) -> np.ndarray:
+        """
+        Returns the time of the moves between 'xy_from' and 'xy_to'.
+        Both are dimension [2, ...] and broadcast against each other.
+        """
+        if self.rotation_speed is None:
+            axes = np.abs(xy_to - xy_from).max(axis=0) / self.speed
+
+        else:
+            radius = np.abs(np.hypot(xy_to[0], xy_to[1]) - np.hypot(xy_from[0], xy_from[1]))
+            angle = np.rad2deg(np.arctan2(xy_to[1], xy_to[0]) - np.arctan2(xy_from[1], xy_from[0]))
+            angle = np.abs((angle + 180) % 360 - 180)
+
+            axes = np.maximum(radius / self.speed, angle / self.rotation_speed)
+
+        return axes + self.settle
+
+
+    def path_time(self, xy:np.ndarray) -> float:
+        """
+        Returns the time to visit the points 'xy' in order, dimension [2, N]
+        """
+        return float(self.move_time(xy[:, :-1], xy[:, 1:]).sum())
+
+
+
+def path_length(xy:np.ndarray) -> float:
+    """
+    Returns the length of the path through the points 'xy' in order, dimension [2, N]
+    """
+    return float(np.hypot(*np.diff(xy, axis=1)).sum())
+
+
+def serpentine_order(xy:np.ndarray, row_tolerance:float=None) -> np.ndarray:
+    """
+    Returns the order visiting the points row by row (rows along x),
+    alternating direction, e.g. for grid patterns.
+
+    - row_tolerance: points whose y differs less than this are in the same
+        row (default: 0.1% of the y extent)
+    - returns: np.ndarray of indices, dimension [N]
+    """
+    if not check_dim(xy):
+        raise ValueError(f"Expected dimensions [2, N], was given: {xy.shape}")
+
+    if xy.shape[1] == 0:
+        return np.zeros(0, dtype=int)
+
+    if row_tolerance is None:
+        row_tolerance = 1e-3 * np.ptp(xy[1])
+
+    # A new row starts wherever consecutive y values differ by more than the tolerance
+    by_y = np.argsort(xy[1], kind='stable')
+    rows = np.empty(xy.shape[1], dtype=int)
+    rows[by_y] = np.concatenate([[0], np.cumsum(np.diff(xy[1, by_y]) > row_tolerance)])
+
+    direction = np.where(rows % 2 == 0, 1, -1)
+
+    return np.lexsort((direction * xy[0], rows))
+
+
+def nearest_neighbour_order(xy:np.ndarray, stage:StageModel, start:int=0) -> np.ndarray:
+    """
+    Returns the order always moving on to the unvisited point with the
+    shortest move time, starting at point 'start'.
+
+    The move times from the current point to all points are evaluated at
+    once, memory stays linear in the number of points.
+
+    - returns: np.ndarray of indices, dimension [N]
+    """
+    n = xy.shape[1]
+    order = np.empty(n, dtype=int)
+    visited = np.zeros(n, dtype=bool)
+
+    current = start
+    for k in range(n):
+        order[k] = current
+        visited[current] = True
+
+        if k == n - 1:
+            break
+
+        time = stage.move_time(xy[:, current, np.newaxis], xy)
+        time[visited] = np.inf
+        current = int(np.argmin(time))
+
+    return order
+
+
+def two_opt(xy:np.ndarray, order:np.ndarray, stage:StageModel, max_passes:int=20) -> np.ndarray:
+    """
+    Improves the open path 'order' by reversing sections of it (2-opt)
+    as long as that shortens the total move time. The first point is kept.
+
+    For every section start all section ends are evaluated at once.
+
+    - max_passes: maximum number of passes over all section starts
+    - returns: np.ndarray of indices, dimension [N]
+    """
+    order = np.array(order)
+    n = len(order)
+
+    for _ in range(max_passes):
+        improved = False
+
+        for i in range(n - 2):
+            path = xy[:, order]
+
+            # Reversing order[i+1:j+1] replaces the moves (i, i+1) and
+            # (j, j+1) with (i, j) and (i+1, j+1), the last point has no next move
+            j = np.arange(i + 2, n)
+            a, b = path[:, i, np.newaxis], path[:, i + 1, np.newaxis]
+            c = path[:, j]
+
+            delta = stage.move_time(a, c) - stage.move_time(a, b)
+
+            has_next = j < n - 1
+            d = path[:, j[has_next] + 1]
+            delta[has_next] += stage.move_time(b, d) - stage.move_time(c[:, has_next], d)
+
+            best = int(np.argmin(delta))
+            if delta[best] < -1e-12:
+                order[i + 1:j[best] + 1] = order[i + 1:j[best] + 1][::-1]
+                improved = True
+
+        if not improved:
+            break
+
+    return order
@@ -0,0 +1,250 @@
+import numpy as np
+
+from Utilities.Transform import check_dim
+
+
+
+def _expand_ranges_(start:np.ndarray, stop:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Expands the ranges [start, stop) into one flat array of positions,
+    together with the index of the range each position came from
+    """
+    counts = stop - start
+    owner = np.repeat(np.arange(len(start)), counts)
+    first = np.repeat(start - np.cumsum(counts) + counts, counts)
+
+    return owner, first + np.arange(counts.sum())
+
+
+
+class GridIndex:
+    """
+    Grid-bucket spatial index over 2D points.
+
+    Points are sorted by the key of the grid cell they fall in, so the
+    points of any cell are found with a binary search. Queries loop only
+    over the (few) neighbouring cell offsets, never over the points.
+    """
+
+    def __init__(self, xy:np.ndarray, cell:float) -> None:
+        """
+        - xy: np.ndarray dimension [2, N] containing x and y coordinates
+        - cell: side length of the grid cells, ideally close to the query radius
+        """
+        xy = np.asarray(xy, dtype=float)
+        if not check_dim(xy):
+            raise ValueError(f"Expected dimensions [2, N], was given: {xy.shape}")
+
+        if cell <= 0:
+            raise ValueError(f"Cell size must be positive, was given: {cell}")
+
+        self.xy = xy
+        self.cell = cell
+
+        if xy.shape[1] > 0:
+            self.origin = xy.min(axis=1)
+        else:
+            self.origin = np.zeros(2)
+
+        ij = self._cells_(xy)
+        # Leaves room for a cell of padding on both sides, so neighbouring
+        # keys never wrap into another column
+        self._n_rows = int(ij[1].max(initial=0)) + 3
+        self._n_cols = int(ij[0].max(initial=0)) + 1
+
+        keys = self._keys_(ij)
+        self._order = np.argsort(keys, kind='stable')
+        self._keys = keys[self._order]
+
+        return None
+
+
+    def __len__(self) -> int:
+        return self.xy.shape[1]
+
+
+    def _cells_(self, xy:np.ndarray) -> np.ndarray:
+        return np.floor((xy - self.origin[:, np.newaxis]) / self.cell).astype(np.int64)
+
+
+    def _keys_(self, ij:np.ndarray) -> np.ndarray:
+        return (ij[0] + 1) * self._n_rows + (ij[1] + 1)
+
+
+    def _candidates_(self, ij:np.ndarray, di:int, dj:int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (query index, point index) of all points in the cell
+        offset (di, dj) from the query cells 'ij'
+        """
+        j = ij[1] + dj
+        valid = (j >= -1) & (j <= self._n_rows - 2)
+        keys = np.where(valid, self._keys_(np.array([ij[0] + di, j])), -1)
+
+        start = np.searchsorted(self._keys, keys, side='left')
+        stop = np.searchsorted(self._keys, keys, side='right')
+
+        owner, position = _expand_ranges_(start, stop)
+
+        return owner, self._order[position]
+
+
+    def query(self, xy:np.ndarray, radius:float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds all indexed points within 'radius' of the query points
+
+        - xy: np.ndarray dimension [2, M] containing the query points
+        - radius: search radius
+        - returns: (query index, point index) of all matches
+        """
+        xy = np.asarray(xy, dtype=float).reshape(2, -1)
+        ij = self._cells_(xy)
+        reach = int(np.ceil(radius / self.cell))
+
+        queries, points = [], []
+        for di in range(-reach, reach + 1):
+            for dj in range(-reach, reach + 1):
+                q, p = self._candidates_(ij, di, dj)
+
+                d2 = ((self.xy[:, p] - xy[:, q])**2).sum(axis=0)
+                keep = d2 <= radius**2
+
+                queries.append(q[keep])
+                points.append(p[keep])
+
+        return np.concatenate(queries), np.concatenate(points)
+
+
+    def query_boxes(self, low:np.ndarray, high:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds all indexed points inside axis-aligned boxes (boundary included)
+
+        - low: np.ndarray dimension [2, M] containing the lower left corners
+        - high: np.ndarray dimension [2, M] containing the upper right corners
+        - returns: (box index, point index) of all matches
+        """
+        low = np.asarray(low, dtype=float).reshape(2, -1)
+        high = np.asarray(high, dtype=float).reshape(2, -1)
+
+        # Range of grid cells covered by every box, clipped to the occupied grid
+        i0, j0 = np.maximum(self._cells_(low), 0)
+        i1, j1 = self._cells_(high)
+        i1 = np.minimum(i1, self._n_cols - 1)
+        j1 = np.minimum(j1, self._n_rows - 3)
+
+        nx = np.maximum(i1 - i0 + 1, 0)
+        ny = np.maximum(j1 - j0 + 1, 0)
+
+        # One entry per (box, cell)
+        box, cell = _expand_ranges_(np.zeros_like(nx), nx * ny)
+        cells = np.array([
+            i0[box] + cell // ny[box],
+            j0[box] + cell % ny[box],
+        ])
+
+        keys = self._keys_(cells)
+        start = np.searchsorted(self._keys, keys, side='left')
+        stop = np.searchsorted(self._keys, keys, side='right')
+
+        owner, position = _expand_ranges_(start, stop)
+        box = box[owner]
+        point = self._order[position]
+
+        inside = (
+            (self.xy[0, point] >= low[0, box]) & (self.xy[0, point] <= high[0, box]) &
+            (self.xy[1, point] >= low[1, box]) & (self.xy[1, point] <= high[1, box])
+        )
+
+        return box[inside], point[inside]
+
+
+    def pairs(self, radius:float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds all pairs of indexed points within 'radius' of each other
+
+        - radius: search radius
+        - returns: (i, j) with i < j for every pair
+        """
+        ij = self._cells_(self.xy)
+        reach = int(np.ceil(radius / self.cell))
+
+        first, second = [], []
+        for di in range(0, reach + 1):
+            for dj in range(-reach, reach + 1):
+                # Half of the neighbourhood is enough, every pair of cells is visited once
+                if di == 0 and dj < 0:
+                    continue
+
+                i, j = self._candidates_(ij, di, dj)
+                if di == 0 and dj == 0:
+                    keep = i < j
+                    i, j = i[keep], j[keep]
+
+                d2 = ((self.xy[:, i] - self.xy[:, j])**2).sum(axis=0)
+                keep = d2 <= radius**2
+
+                first.append(i[keep])
+                second.append(j[keep])
+
+        i = np.concatenate(first)
+        j = np.concatenate(second)
+
+        return np.minimum(i, j), np.maximum(i, j)
+
+
+    def nearest(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the nearest neighbour of every indexed point.
+
+        The search radius starts around the mean point spacing and is doubled
+        for the points without a neighbour, until every point is resolved.
+
+        - returns: (distance, index) of the nearest neighbour, np.inf and -1
+            if there is only a single point
+        """
+        n = len(self)
+        distance = np.full(n, np.inf)
+        index = np.full(n, -1)
+
+        if n < 2:
+            return distance, index
+
+        unresolved = np.arange(n)
+        extent = np.ptp(self.xy, axis=1).max()
+
+        # Start around the mean point spacing, which resolves most points
+        # in the first pass without collecting many candidates. Cells much
+        # larger than that would flood the search, so a finer grid is used.
+        spacing = np.sqrt(np.prod(np.ptp(self.xy, axis=1)) / n)
+        grid = self
+        radius = self.cell
+        if 0 < spacing < self.cell / 2:
+            grid = GridIndex(self.xy, spacing)
+            radius = spacing
+
+        while len(unresolved) > 0:
+            q, p = grid.query(self.xy[:, unresolved], radius)
+
+            keep = unresolved[q] != p
+            q, p = q[keep], p[keep]
+            d = np.hypot(*(self.xy[:, p] - self.xy[:, unresolved[q]]))
+
+            # Minimum distance per query point
+            order = np.lexsort((d, q))
+            q, p, d = q[order], p[order], d[order]
+            first = np.unique(q, return_index=True)[1]
+
+            found = unresolved[q[first]]
+            distance[found] = d[first]
+            index[found] = p[first]
+
+            resolved = np.zeros(len(unresolved), dtype=bool)
+            resolved[q[first]] = True
+            unresolved = unresolved[~resolved]
+
+            # Coincident points give extent 0, the loop ends after one pass
+            if radius > 2 * extent:
+                break
+
+            radius *= 2
+
+        return distance, index
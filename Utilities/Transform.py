@@ -11,46 +11,269 @@ def check_dim(array:np.ndarray) -> bool:
     """
     if not isinstance(array, np.ndarray):
         raise ValueError(f"Expeced numpy.array, was given: {type(array)}")
-    
+
     if array.shape[0] != 2:
         return False
     else:
         return True
-        
 
 
-def rotate(xy:np.ndarray, angle:float) -> np.ndarray:
+
+def _result_dtype_(xy:np.ndarray, dtype=None) -> np.dtype:
+    """
+    Returns the floating point dtype used for transforming 'xy'.
+    float32 input stays float32, everything else is promoted to float64,
+    unless 'dtype' is given explicitly.
+    """
+    if dtype is not None:
+        return np.dtype(dtype)
+
+    return np.result_type(xy.dtype, np.float32)
+
+
+
+class Affine:
+    """
+    Affine transformation of 2D coordinates.
+
+    The transformation is stored as a 3x3 matrix in homogeneous coordinates,
+    so any chain of rotations, translations and scalings collapses into
+    a single matrix product when applied to the coordinates.
+    """
+
+    def __init__(self, matrix:np.ndarray=None) -> None:
+        """
+        - matrix: 3x3 matrix in homogeneous coordinates (default: identity)
+        """
+        if matrix is None:
+            matrix = np.eye(3)
+
+        matrix = np.array(matrix, dtype=float)
+
+        if matrix.shape != (3, 3):
+            raise ValueError(f"Expected 3x3 matrix, was given: {matrix.shape}")
+
+        self.matrix = matrix
+
+        return None
+
+
+    @classmethod
+    def rotation(cls, angle:float):
+        """
+        Rotation 'angle' degrees around (0, 0)
+        """
+        rad = np.deg2rad(angle)
+        c, s = np.cos(rad), np.sin(rad)
+
+        return cls([
+            [c, -s, 0],
+            [s, c, 0],
+            [0, 0, 1],
+        ])
+
+
+    @classmethod
+    def translation(cls, x:float, y:float):
+        """
+        Translation with offset (x, y)
+        """
+        return cls([
+            [1, 0, x],
+            [0, 1, y],
+            [0, 0, 1],
+        ])
+
+
+    @classmethod
+    def scaling(cls, sx:float, sy:float=None):
+        """
+        Scaling around (0, 0), uniform if 'sy' is not given
+        """
+        if sy is None:
+            sy = sx
+
+        return cls([
+            [sx, 0, 0],
+            [0, sy, 0],
+            [0, 0, 1],
+        ])
+
+
+    @classmethod
+    def fit_rigid(cls, source:np.ndarray, target:np.ndarray, weights:np.ndarray=None):
+        """
+        Least-squares rotation followed by translation taking 'source' onto
+        'target', in closed form (2D Kabsch/Procrustes, no scaling)
+
+        - source, target: np.ndarray dimension [2, N], N >= 2 (with weight)
+        - weights: optional weight of every point, dimension [N]
+        """
+        source = np.asarray(source, dtype=float)
+        target = np.asarray(target, dtype=float)
+        if not (check_dim(source) and check_dim(target)) or source.shape != target.shape:
+            raise ValueError(f"Expected two arrays of dimensions [2, N], were given: {source.shape} and {target.shape}")
+
+        if weights is None:
+            weights = np.ones(source.shape[1])
+        weights = np.asarray(weights, dtype=float)
+
+        if np.count_nonzero(weights) < 2:
+            raise ValueError("At least 2 points are needed to fit a rotation")
+
+        weights = weights / weights.sum()
+        source_mean = source @ weights
+        target_mean = target @ weights
+
+        s = source - source_mean[:, np.newaxis]
+        t = target - target_mean[:, np.newaxis]
+
+        # Angle maximizing the weighted sum of dot products after rotation
+        sine = np.sum(weights * (s[0] * t[1] - s[1] * t[0]))
+        cosine = np.sum(weights * (s[0] * t[0] + s[1] * t[1]))
+        angle = np.rad2deg(np.arctan2(sine, cosine))
+
+        rotation = cls.rotation(angle)
+
+        return rotation.translate(*(target_mean - rotation.apply(source_mean)))
+
+
+    def __matmul__(self, other):
+        """
+        Composition, (A @ B) applies B first and then A
+        """
+        return Affine(self.matrix @ other.matrix)
+
+
+    def __repr__(self) -> str:
+        return f"Affine({self.matrix.tolist()})"
+
+
+    def then(self, other):
+        """
+        Returns the transformation applying 'self' followed by 'other'
+        """
+        return other @ self
+
+
+    def rotate(self, angle:float):
+        """
+        Returns the transformation followed by a rotation of 'angle' degrees
+        """
+        return self.then(Affine.rotation(angle))
+
+
+    def translate(self, x:float, y:float):
+        """
+        Returns the transformation followed by a translation of (x, y)
+        """
+        return self.then(Affine.translation(x, y))
+
+
+    def scale(self, sx:float, sy:float=None):
+        """
+        Returns the transformation followed by a scaling of (sx, sy)
+        """
+        return self.then(Affine.scaling(sx, sy))
+
+
+    def inverse(self):
+        """
+        Returns the inverse transformation
+        """
+        return Affine(np.linalg.inv(self.matrix))
+
+
+    @property
+    def linear(self) -> np.ndarray:
+        """
+        The 2x2 linear part (rotation/scaling) of the transformation
+        """
+        return self.matrix[:2, :2]
+
+
+    @property
+    def offset(self) -> np.ndarray:
+        """
+        The translation part of the transformation, dimension [2]
+        """
+        return self.matrix[:2, 2]
+
+
+    def apply(self, xy:np.ndarray, out:np.ndarray=None, dtype=None) -> np.ndarray:
+        """
+        Applies the transformation to all coordinates in one pass.
+
+        - xy: np.ndarray dimension [2, N] (or [2]) containing x and y coordinates
+        - out: optional floating point output buffer with the same shape as 'xy', may be 'xy' itself
+        - dtype: floating point type of the result, e.g. np.float32
+        - returns: transformed version of xy
+        """
+        xy = np.asarray(xy)
+        if not check_dim(xy):
+            raise ValueError(f"Expected dimensions [2, N], was given: {xy.shape}")
+
+        if out is not None:
+            # The matrix is cast to the buffer type, an integer buffer would round it
+            if not np.issubdtype(out.dtype, np.floating):
+                raise ValueError(f"Expected a floating point output buffer, was given: {out.dtype}")
+
+            dtype = out.dtype
+
+        dtype = _result_dtype_(xy, dtype)
+        linear = self.linear.astype(dtype, copy=False)
+        offset = self.offset.astype(dtype, copy=False)
+
+        if xy.ndim == 2:
+            offset = offset[:, np.newaxis]
+
+        out = np.matmul(linear, xy.astype(dtype, copy=False), out=out)
+        out += offset
+
+        return out
+
+
+    __call__ = apply
+
+
+
+def rotate(xy:np.ndarray, angle:float, out:np.ndarray=None) -> np.ndarray:
     """
     Rotates a Numpy array [2, N] 'angle' degree around (0, 0)
     xy: np.ndarray dimension [2, N] containing x and y coordinates
     angle: float rotational angle in degrees
+    out: optional output buffer with the same shape as 'xy'
     return: rotated version of xy
     """
     check_dim(xy)
 
-    def rotator(array2d:np.ndarray) -> np.ndarray:
-        rad = np.deg2rad(angle)
-        A = np.array([
-            [np.cos(rad), -np.sin(rad)],
-            [np.sin(rad), np.cos(rad)]
-        ])
-        return A.dot(array2d)
-    
-    return np.apply_along_axis(rotator, axis=0, arr=xy)
-    
-    
+    return Affine.rotation(angle).apply(xy, out=out)
+
 
-def translate(xy:np.ndarray, offset:np.ndarray) -> np.ndarray:
+
+def translate(xy:np.ndarray, offset:np.ndarray, out:np.ndarray=None) -> np.ndarray:
     """
     Translates Numpy array [2, N] 'offset' amount
     xy: np.ndarray dimension [2, N] containing x and y coordinates
     offset: np.ndarray dimension [2, 1] containing offset
+    out: optional output buffer with the same shape as 'xy'
     return: translated version of xy
     """
     check_dim(xy)
-    
-    def translator(array2d:np.ndarray) -> np.ndarray:
-        return offset + array2d
-        
-    return np.apply_along_axis(translator, axis=0, arr=xy)
 
+    offset = np.asarray(offset).reshape((2,) + (1,) * (xy.ndim - 1))
+
+    return np.add(xy, offset, out=out)
+
+
+
+def scale(xy:np.ndarray, sx:float, sy:float=None, out:np.ndarray=None) -> np.ndarray:
+    """
+    Scales Numpy array [2, N] around (0, 0), uniform if 'sy' is not given
+    xy: np.ndarray dimension [2, N] containing x and y coordinates
+    out: optional output buffer with the same shape as 'xy'
+    return: scaled version of xy
+    """
+    check_dim(xy)
+
+    return Affine.scaling(sx, sy).apply(xy, out=out)
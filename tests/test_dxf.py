@@ -0,0 +1,31 @@
+import ezdxf
+import numpy as np
+import pytest
+
+from Modules import DXF
+
+
+@pytest.fixture
+def stage_file(tmp_path) -> str:
+    """
+    Drawing ending in a simple entity, which single-pass streaming used to drop
+    """
+    doc = ezdxf.new()
+    msp = doc.modelspace()
+    msp.add_line((0, 0), (1, 0), dxfattribs={'layer': 'holes'})
+    msp.add_circle((0, 0), 1, dxfattribs={'layer': 'holes'})
+
+    filename = str(tmp_path / 'stage.dxf')
+    doc.saveas(filename)
+
+    return filename
+
+
+@pytest.mark.parametrize('layers', [None, ['holes']])
+def test_streamed_load_matches_load(stage_file, layers):
+    loaded = DXF.load(stage_file, layers=layers).polylines()
+    streamed = DXF.load(stage_file, layers=layers, stream=True).polylines()
+
+    assert len(loaded) == len(streamed) == 2
+    for a, b in zip(loaded, streamed):
+        np.testing.assert_allclose(a, b)